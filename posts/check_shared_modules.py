@@ -0,0 +1,44 @@
+"""Check that helper modules shared between posts are still identical
+
+uv-testing is a standalone uv project, so it keeps its own copy of the
+helpers prompt-testing imports from src/. Edit one copy, copy it over, then
+run this from the repo root; it prints a diff and exits non-zero if any pair
+differs:
+
+    python posts/check_shared_modules.py
+"""
+
+import difflib
+import os
+import sys
+
+POSTS = os.path.dirname(os.path.abspath(__file__))
+
+SHARED = [
+    ("uv-testing/response_cache.py", "prompt-testing/src/response_cache.py"),
+    ("uv-testing/token_budget.py", "prompt-testing/src/token_budget.py"),
+    ("uv-testing/timing.py", "prompt-testing/src/timing.py"),
+]
+
+
+def read_lines(path):
+    with open(os.path.join(POSTS, path), "r", encoding="utf-8") as f:
+        return f.readlines()
+
+
+def main():
+    differing = []
+    for first, second in SHARED:
+        diff = list(difflib.unified_diff(read_lines(first), read_lines(second), first, second))
+        if diff:
+            differing.append(first)
+            sys.stdout.writelines(diff)
+
+    if differing:
+        sys.exit(f"{len(differing)} of {len(SHARED)} shared modules differ between copies")
+
+    print(f"all {len(SHARED)} shared modules identical")
+
+
+if __name__ == "__main__":
+    main()
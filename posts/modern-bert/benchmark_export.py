@@ -0,0 +1,79 @@
+"Parity and speed check: eager fp32 vs int8 torch vs ONNX Runtime on CPU"
+
+import argparse
+import sys
+import time
+
+import pandas as pd
+import torch
+from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+from src.export import OnnxClassifier, export_onnx, quantize_int8
+from src.transformer_funcs import batched_prediction
+
+MAX_LENGTH = 128
+BATCH_SIZE = 64
+ATOL = 1e-2
+
+# int8 is lossy by design, so it is held to predicting the same class as
+# fp32 on most rows rather than to ATOL
+INT8_MIN_AGREEMENT = 0.98
+
+
+def time_backend(model, texts, tokenizer):
+    start = time.perf_counter()
+    logits = batched_prediction(model, texts, tokenizer, MAX_LENGTH, BATCH_SIZE)
+    return logits, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("model_dir", help="directory of the fine-tuned model")
+    parser.add_argument("data", help="csv with a Narrative_1 column")
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--onnx-path", default="model.onnx")
+    parser.add_argument("--int8-min-agreement", type=float, default=INT8_MIN_AGREEMENT)
+    args = parser.parse_args()
+
+    torch.set_grad_enabled(False)
+    tokenizer = AutoTokenizer.from_pretrained(args.model_dir)
+    model = AutoModelForSequenceClassification.from_pretrained(args.model_dir)
+    texts = pd.read_csv(args.data)["Narrative_1"].head(args.rows).tolist()
+
+    export_onnx(model, tokenizer, args.onnx_path, MAX_LENGTH)
+    backends = {
+        "eager_fp32": model,
+        "torch_int8": quantize_int8(model),
+        "onnxruntime": OnnxClassifier(args.onnx_path),
+    }
+
+    reference = None
+    failed = []
+    for name, backend in backends.items():
+        logits, elapsed = time_backend(backend, texts, tokenizer)
+        if reference is None:
+            reference = logits
+
+        max_diff = (logits - reference).abs().max().item()
+        agree = (logits.argmax(-1) == reference.argmax(-1)).float().mean().item()
+
+        # the exact export is held to ATOL, int8 to an argmax agreement floor
+        flag = ""
+        if name == "onnxruntime" and max_diff > ATOL:
+            flag = f"  (FAIL: max |dlogit| above {ATOL})"
+        elif name == "torch_int8" and agree < args.int8_min_agreement:
+            flag = f"  (FAIL: agreement below {args.int8_min_agreement})"
+        if flag:
+            failed.append(name)
+
+        print(
+            f"{name:<12} {len(texts) / elapsed:8.1f} rows/s  "
+            f"max |dlogit| {max_diff:.4f}  argmax agreement {agree:.4f}{flag}"
+        )
+
+    if failed:
+        sys.exit(f"parity check failed for {', '.join(failed)}")
+
+
+if __name__ == "__main__":
+    main()
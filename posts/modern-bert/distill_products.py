@@ -0,0 +1,141 @@
+"""Distill gpt-4o-mini NEISS product labels into a local classifier
+
+    train:   fit on the labels returned by the uv-testing batch, calibrating
+             a confidence threshold on a held-out split
+    predict: label narratives locally and write which rows still need the LLM
+
+The predictions csv is read by uv-testing/prepare_batch.py (LOCAL_PREDICTIONS),
+which only submits the rows routed to "llm".
+"""
+
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from src.distill import (
+    LocalLabeler,
+    confidence_threshold,
+    load_llm_labels,
+    load_product_catalog,
+    save_settings,
+    train_classifier,
+)
+from src.transformer_funcs import batched_prediction
+from src.utils import LabelEncoder
+
+ID_COLUMN = "CPSC_Case_Number"
+TEXT_COLUMN = "Narrative_1"
+
+
+def train(args):
+    labels = load_llm_labels(args.results, load_product_catalog(args.catalog))
+    data = pd.read_csv(args.data)
+    data = data[data[ID_COLUMN].astype(str).isin(labels)].reset_index(drop=True)
+    codes = np.array([labels[str(i)][0] for i in data[ID_COLUMN]])
+    print(f"{len(data)} LLM-labeled narratives, {len(set(codes))} products")
+
+    # label set is the catalog products the LLM actually returned
+    label_encoder = LabelEncoder(dict(labels.values()))
+
+    # hold out a split to calibrate the routing threshold
+    rng = np.random.default_rng(args.seed)
+    order = rng.permutation(len(data))
+    n_val = int(len(data) * args.val_fraction)
+    val, fit = order[:n_val], order[n_val:]
+    if not n_val:
+        raise ValueError("No rows held out for calibration, raise --val-fraction")
+    texts = data[TEXT_COLUMN].tolist()
+
+    model, tokenizer = train_classifier(
+        [texts[i] for i in fit],
+        codes[fit],
+        label_encoder,
+        args.model_name,
+        args.model_dir,
+        max_length=args.max_length,
+        epochs=args.epochs,
+        batch_size=args.batch_size,
+        learning_rate=args.learning_rate,
+        seed=args.seed,
+    )
+
+    _, val_codes, _, val_probs = batched_prediction(
+        model,
+        [texts[i] for i in val],
+        tokenizer,
+        args.max_length,
+        return_labels=True,
+        label_encoder=label_encoder,
+    )
+    correct = val_codes == codes[val]
+    threshold, coverage = confidence_threshold(val_probs, correct, args.target_accuracy)
+    print(
+        f"validation agreement {correct.mean():.3f}, threshold {threshold:.3f} keeps "
+        f"{coverage:.1%} of rows local at >= {args.target_accuracy:.0%} agreement"
+    )
+
+    save_settings(
+        args.model_dir,
+        threshold=threshold,
+        coverage=coverage,
+        target_accuracy=args.target_accuracy,
+        max_length=args.max_length,
+    )
+
+
+def predict(args):
+    labeler = LocalLabeler(args.model_dir, args.batch_size)
+    data = pd.read_csv(args.data)
+    if args.rows:
+        data = data.head(args.rows)
+
+    codes, products, probs, local = labeler.predict(data[TEXT_COLUMN].tolist())
+    predictions = pd.DataFrame(
+        {
+            ID_COLUMN: data[ID_COLUMN],
+            "product_code": codes,
+            "product": products,
+            "confidence": probs,
+            "route": np.where(local, "local", "llm"),
+        }
+    )
+    predictions.to_csv(args.output, index=False)
+    print(f"{local.sum()} of {len(local)} rows labeled locally, written to {args.output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    train_parser = subparsers.add_parser("train")
+    train_parser.add_argument("results", help="merged batch output jsonl")
+    train_parser.add_argument("data", help="NEISS csv the batch was built from")
+    train_parser.add_argument(
+        "--catalog", required=True, help="NEISS product code json used to build the prompts"
+    )
+    train_parser.add_argument("--model-name", default="answerdotai/ModernBERT-base")
+    train_parser.add_argument("--model-dir", default="models/product_classifier")
+    train_parser.add_argument("--max-length", type=int, default=128)
+    train_parser.add_argument("--epochs", type=int, default=3)
+    train_parser.add_argument("--batch-size", type=int, default=32)
+    train_parser.add_argument("--learning-rate", type=float, default=5e-5)
+    train_parser.add_argument("--val-fraction", type=float, default=0.2)
+    train_parser.add_argument("--target-accuracy", type=float, default=0.95)
+    train_parser.add_argument("--seed", type=int, default=0)
+    train_parser.set_defaults(func=train)
+
+    predict_parser = subparsers.add_parser("predict")
+    predict_parser.add_argument("data", help="NEISS csv to label")
+    predict_parser.add_argument("--model-dir", default="models/product_classifier")
+    predict_parser.add_argument("--output", default="local_predictions.csv")
+    predict_parser.add_argument("--rows", type=int, default=None)
+    predict_parser.add_argument("--batch-size", type=int, default=64)
+    predict_parser.set_defaults(func=predict)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
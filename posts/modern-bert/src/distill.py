@@ -0,0 +1,172 @@
+import json
+import os
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+from transformers import (
+    AutoModelForSequenceClassification,
+    AutoTokenizer,
+    get_linear_schedule_with_warmup,
+)
+
+from .transformer_funcs import (
+    CustomDataset,
+    DynamicPaddingCollator,
+    LengthBucketSampler,
+    batched_prediction,
+)
+from .utils import LabelEncoder
+
+SETTINGS_FILE = "distill.json"
+
+
+def load_product_catalog(path):
+    "{product code: title} from the NEISS product code json"
+    with open(path, "r", encoding="utf-8") as f:
+        return {int(p["code"]): p["product_title"] for p in json.load(f)}
+
+
+def load_llm_labels(results_path, catalog):
+    """Read product labels from a merged OpenAI batch output file.
+
+    Returns {custom_id: (product_code, product title)}. Rows that failed,
+    did not return valid JSON, were labeled locally, or name a code that is
+    not in `catalog` (hallucinated codes) are skipped.
+    """
+    labels = {}
+    n_unknown = 0
+    with open(results_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            response = result.get("response") or {}
+            if result.get("local") or response.get("status_code") != 200:
+                continue
+
+            try:
+                content = response["body"]["choices"][0]["message"]["content"]
+                answer = json.loads(content)
+                code = int(answer["product_code"])
+            except (KeyError, IndexError, TypeError, ValueError):
+                continue
+
+            if code not in catalog:
+                n_unknown += 1
+                continue
+
+            labels[result["custom_id"]] = (code, catalog[code])
+
+    if n_unknown:
+        print(f"dropped {n_unknown} labels with codes outside the product catalog")
+
+    return labels
+
+
+def train_classifier(
+    texts,
+    codes,
+    label_encoder,
+    model_name,
+    output_dir,
+    max_length=128,
+    epochs=3,
+    batch_size=32,
+    learning_rate=5e-5,
+    seed=0,
+):
+    """Fine-tune a sequence classifier on LLM-labeled texts and save it, its
+    tokenizer and label mapping to `output_dir`"""
+    torch.manual_seed(seed)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    id2label, label2id = label_encoder.to_config()
+    model = AutoModelForSequenceClassification.from_pretrained(
+        model_name, num_labels=len(label_encoder), id2label=id2label, label2id=label2id
+    )
+
+    dataset = CustomDataset(
+        list(texts), label_encoder.encode(codes), tokenizer, max_length, pretokenize=True
+    )
+    loader = DataLoader(
+        dataset,
+        batch_sampler=LengthBucketSampler(dataset.lengths, batch_size, seed=seed),
+        collate_fn=DynamicPaddingCollator(tokenizer.pad_token_id),
+    )
+
+    optimizer = torch.optim.AdamW(model.parameters(), lr=learning_rate)
+    total_steps = epochs * len(loader)
+    scheduler = get_linear_schedule_with_warmup(optimizer, total_steps // 10, total_steps)
+
+    model.train()
+    for epoch in range(epochs):
+        running_loss = 0.0
+        for batch in loader:
+            loss = model(**batch).loss
+            loss.backward()
+            optimizer.step()
+            scheduler.step()
+            optimizer.zero_grad()
+            running_loss += loss.item()
+
+        print(f"epoch {epoch + 1}/{epochs} loss {running_loss / len(loader):.4f}")
+
+    os.makedirs(output_dir, exist_ok=True)
+    model.save_pretrained(output_dir)
+    tokenizer.save_pretrained(output_dir)
+    label_encoder.save(output_dir)
+
+    return model, tokenizer
+
+
+def confidence_threshold(probs, correct, target_accuracy=0.95):
+    """Lowest softmax probability at which the rows scoring at or above it
+    agree with the LLM at least `target_accuracy` of the time.
+
+    Returns (threshold, coverage), coverage being the share of rows that
+    would be labeled locally. With no such threshold nothing is kept local.
+    """
+    order = np.argsort(-np.asarray(probs))
+    probs = np.asarray(probs)[order]
+    accuracy = np.cumsum(np.asarray(correct)[order]) / np.arange(1, len(order) + 1)
+
+    passing = np.flatnonzero(accuracy >= target_accuracy)
+    if not len(passing):
+        return float("inf"), 0.0
+
+    last = passing[-1]
+    return float(probs[last]), (last + 1) / len(order)
+
+
+def save_settings(model_dir, **settings):
+    with open(os.path.join(model_dir, SETTINGS_FILE), "w") as f:
+        json.dump(settings, f, indent=2)
+
+
+class LocalLabeler:
+    """Serve a distilled classifier on CPU. Rows below the calibrated
+    confidence threshold are routed back to the LLM."""
+
+    def __init__(self, model_dir, batch_size=64):
+        with open(os.path.join(model_dir, SETTINGS_FILE), "r") as f:
+            self.settings = json.load(f)
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.model = AutoModelForSequenceClassification.from_pretrained(model_dir)
+        self.label_encoder = LabelEncoder.load(model_dir)
+        self.threshold = self.settings["threshold"]
+        self.batch_size = batch_size
+
+    def predict(self, texts):
+        "Return (codes, labels, probabilities, local mask) for a list of texts"
+        _, codes, labels, probs = batched_prediction(
+            self.model,
+            texts,
+            self.tokenizer,
+            self.settings["max_length"],
+            self.batch_size,
+            return_labels=True,
+            label_encoder=self.label_encoder,
+        )
+
+        return codes, labels, probs, probs >= self.threshold
@@ -0,0 +1,82 @@
+"Export the fine-tuned classifier for CPU inference (ONNX or int8 torch)"
+
+import numpy as np
+import torch
+
+
+class _LogitsOnly(torch.nn.Module):
+    "Wrap a model so forward returns a plain logits tensor (needed for tracing)"
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        outputs = self.model(input_ids, attention_mask)
+        return getattr(outputs, "logits", outputs)
+
+
+def export_onnx(fitted_model, tokenizer, onnx_path, max_length, opset=17):
+    "Export to ONNX with dynamic batch and sequence axes"
+    fitted_model.eval()
+
+    dummy = tokenizer(
+        ["example narrative"],
+        truncation=True,
+        max_length=max_length,
+        return_tensors="pt",
+    )
+
+    torch.onnx.export(
+        _LogitsOnly(fitted_model),
+        (dummy["input_ids"], dummy["attention_mask"]),
+        onnx_path,
+        input_names=["input_ids", "attention_mask"],
+        output_names=["logits"],
+        dynamic_axes={
+            "input_ids": {0: "batch", 1: "sequence"},
+            "attention_mask": {0: "batch", 1: "sequence"},
+            "logits": {0: "batch"},
+        },
+        opset_version=opset,
+    )
+
+    return onnx_path
+
+
+def quantize_int8(fitted_model):
+    "Dynamic int8 quantization of all Linear layers for CPU inference"
+    fitted_model.eval()
+    return torch.quantization.quantize_dynamic(
+        fitted_model, {torch.nn.Linear}, dtype=torch.qint8
+    )
+
+
+class OnnxClassifier:
+    """ONNX Runtime backend with the same call signature as the torch model,
+    so it can be passed straight into `batched_prediction`"""
+
+    def __init__(self, onnx_path, num_threads=None):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+
+        self.session = ort.InferenceSession(
+            onnx_path, options, providers=["CPUExecutionProvider"]
+        )
+
+    def eval(self):
+        return self
+
+    def __call__(self, input_ids, attention_mask):
+        (logits,) = self.session.run(
+            ["logits"],
+            {
+                "input_ids": np.asarray(input_ids, dtype=np.int64),
+                "attention_mask": np.asarray(attention_mask, dtype=np.int64),
+            },
+        )
+        return torch.from_numpy(logits)
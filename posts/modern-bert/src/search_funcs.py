@@ -1,7 +1,71 @@
 import torch
 import numpy as np
+import json
 import os
 import pickle
+import threading
+import time
+from collections import defaultdict, deque
+
+# recent durations kept per stage for percentiles
+SAMPLE_SIZE = 1024
+
+
+class StageTimer:
+    """Per-stage call counts, total and max wall time, plus the most recent
+    SAMPLE_SIZE durations for percentiles, so memory stays flat in a
+    long-running server. Safe to update from several threads."""
+
+    def __init__(self):
+        self._stages = {}
+        self._counters = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            if stage not in self._stages:
+                self._stages[stage] = {
+                    "calls": 0,
+                    "total": 0.0,
+                    "max": 0.0,
+                    "recent": deque(maxlen=SAMPLE_SIZE),
+                }
+            entry = self._stages[stage]
+            entry["calls"] += 1
+            entry["total"] += seconds
+            entry["max"] = max(entry["max"], seconds)
+            entry["recent"].append(seconds)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self._counters[name] += n
+
+    def report(self):
+        "Per-stage calls, total (s) and mean/percentile/max (ms), plus counters"
+        with self._lock:
+            stages = {}
+            for stage, entry in self._stages.items():
+                p50, p90, p99 = np.percentile(list(entry["recent"]), [50, 90, 99])
+                stages[stage] = {
+                    "calls": entry["calls"],
+                    "total_s": entry["total"],
+                    "mean_ms": 1000 * entry["total"] / entry["calls"],
+                    "p50_ms": 1000 * p50,
+                    "p90_ms": 1000 * p90,
+                    "p99_ms": 1000 * p99,
+                    "max_ms": 1000 * entry["max"],
+                }
+
+            return {"stages": stages, "counters": dict(self._counters)}
+
+    def write_report(self, path):
+        "Write the report as JSON"
+        report = self.report()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+
+        return report
 
 
 class RetrieveReranker:
@@ -12,6 +76,8 @@ class RetrieveReranker:
         cross_encoder_model,
         save_corpus=False,
         corpus_path=None,
+        corpus_embed=None,
+        normalized=False,
     ):
         self.bi_encoder_model = bi_encoder_model
         self.cross_encoder_model = cross_encoder_model
@@ -19,7 +85,23 @@ class RetrieveReranker:
         self.corpus_path = corpus_path
 
         self.corpus = corpus  # raw text
-        self.corpus_embed = self._embed_corpus()  # embedded text
+
+        # wall time per stage and cross-encoder pairs scored, see
+        # `timing_report`. `last_timings` holds the stages of the latest query
+        self.timer = StageTimer()
+        self.last_timings = {}
+
+        # embedded text, unless precomputed embeddings are passed in
+        if corpus_embed is not None:
+            self.corpus_embed = corpus_embed
+        else:
+            self.corpus_embed = self._embed_corpus()
+
+        # with L2-normalized float32 embeddings, cosine similarity is a plain
+        # matmul against a zero-copy tensor view of the corpus
+        self.normalized = normalized
+        if normalized:
+            self._corpus_t = torch.from_numpy(np.asarray(self.corpus_embed))
 
     def _embed_corpus(self):
         "Embed and save a corpus of searchable text, or load corpus if present"
@@ -29,7 +111,9 @@ class RetrieveReranker:
             if os.path.exists(self.corpus_path):
                 embedding = self._load_corpus()
             else:
+                start = time.perf_counter()
                 embedding = self.bi_encoder_model.encode(self.corpus)
+                self._record("embed_corpus", start)
 
                 if self.save_corpus:
                     self._save_corpus(embedding)
@@ -39,6 +123,20 @@ class RetrieveReranker:
 
         return embedding
 
+    def _record(self, stage, start):
+        seconds = time.perf_counter() - start
+        self.timer.add(stage, seconds)
+        self.last_timings[stage] = seconds
+
+    def timing_report(self):
+        """Calls, total seconds and p50/p90/p99 latency per stage
+        (embed_corpus, retrieve, rerank), plus pairs scored"""
+        return self.timer.report()
+
+    def write_report(self, path):
+        "Write `timing_report` as JSON to `path`"
+        return self.timer.write_report(path)
+
     def _save_corpus(self, embedding):
         with open(self.corpus_path, "wb") as fOut:
             pickle.dump(embedding, fOut)
@@ -47,16 +145,30 @@ class RetrieveReranker:
         with open(self.corpus_path, "rb") as fIn:
             return pickle.load(fIn)
 
+    def _similarity(self, query):
+        "Cosine similarities of query embeddings against the corpus"
+        if self.normalized:
+            query_embed = self.bi_encoder_model.encode(
+                query, normalize_embeddings=True, convert_to_numpy=True
+            )
+            query_t = torch.from_numpy(np.atleast_2d(query_embed).astype(np.float32))
+            return query_t @ self._corpus_t.T
+
+        query_embed = self.bi_encoder_model.encode(query)
+        return self.bi_encoder_model.similarity(query_embed, self.corpus_embed)
+
     def query(self, query_string, number_ranks=100, number_results=1):
         """Find the top N results matching the input string and returning the
         matched string and the index."""
 
         ce_list = []
+        self.last_timings = {}
 
         # embed query in bi-enocder, then get cosine similarities w/ corpus
-        query_embed = self.bi_encoder_model.encode(query_string)
-        sims = self.bi_encoder_model.similarity(query_embed, self.corpus_embed)
+        start = time.perf_counter()
+        sims = self._similarity(query_string)
         idx = np.array(torch.topk(sims, number_ranks).indices)[0]
+        self._record("retrieve", start)
 
         # create a list of paired strings
         for i in idx:
@@ -64,7 +176,10 @@ class RetrieveReranker:
 
         # run cross-encoder, get top `number_results`
         # convert to probabilities using invlogit
+        start = time.perf_counter()
         scores = self.cross_encoder_model.predict(ce_list)
+        self._record("rerank", start)
+        self.timer.count("pairs_scored", len(ce_list))
         probs = torch.sigmoid(torch.tensor(scores))
         top_idx = np.argsort(scores)[-number_results:][::-1]
             
@@ -74,3 +189,37 @@ class RetrieveReranker:
         res_str = [ce_list[i][1] for i in top_idx] 
 
         return res_idx, res_prb, res_str 
+
+    def query_batch(self, query_strings, number_ranks=100, number_results=1):
+        """Batched version of `query`. All queries are embedded in one pass and
+        every candidate pair is scored in a single cross-encoder call. Returns a
+        list of (index, probability, string) tuples, one per query."""
+
+        self.last_timings = {}
+        start = time.perf_counter()
+        sims = self._similarity(query_strings)
+        idx = np.array(torch.topk(sims, number_ranks).indices)
+        self._record("retrieve", start)
+
+        # pair every query with its own candidates
+        ce_list = [
+            [q, self.corpus[i]] for q, q_idx in zip(query_strings, idx) for i in q_idx
+        ]
+
+        start = time.perf_counter()
+        scores = np.asarray(self.cross_encoder_model.predict(ce_list))
+        self._record("rerank", start)
+        self.timer.count("pairs_scored", len(ce_list))
+        scores = scores.reshape(len(query_strings), -1)
+        probs = torch.sigmoid(torch.tensor(scores))
+
+        results = []
+        for q_idx, q_scores, q_probs in zip(idx, scores, probs):
+            top_idx = np.argsort(q_scores)[-number_results:][::-1]
+
+            res_idx = [int(q_idx[i]) for i in top_idx]
+            res_prb = torch.tensor([q_probs[i] for i in top_idx])
+            res_str = [self.corpus[i] for i in res_idx]
+            results.append((res_idx, res_prb, res_str))
+
+        return results
@@ -0,0 +1,272 @@
+"Multi-process serving for RetrieveReranker with shared corpus embeddings"
+
+import os
+import queue
+import threading
+import time
+import numpy as np
+
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+from .search_funcs import RetrieveReranker, StageTimer
+
+# per-worker state, set once by `_init_worker`
+_worker_ranker = None
+_worker_shm = None
+
+
+class SharedEmbeddings:
+    """Corpus embeddings held in one shared memory block. The parent process
+    creates the block, workers attach to it by name without copying."""
+
+    def __init__(self, shm, shape, dtype, owner=False):
+        self.shm = shm
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.owner = owner
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=self.shm.buf)
+
+    @classmethod
+    def create(cls, embeddings, dtype="float32"):
+        "Copy an embedding matrix into a new shared memory block"
+        embeddings = np.asarray(embeddings, dtype=dtype)
+        shm = shared_memory.SharedMemory(create=True, size=embeddings.nbytes)
+        shared = cls(shm, embeddings.shape, embeddings.dtype, owner=True)
+        shared.array[:] = embeddings
+
+        return shared
+
+    @classmethod
+    def attach(cls, name, shape, dtype):
+        "Attach to an existing block created by another process"
+        return cls(shared_memory.SharedMemory(name=name), shape, dtype)
+
+    @property
+    def spec(self):
+        "Arguments needed to re-attach from another process"
+        return self.shm.name, self.shape, self.dtype.str
+
+    def close(self):
+        self.array = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def _init_worker(corpus, shm_spec, bi_encoder_name, cross_encoder_name, n_threads):
+    "Load one copy of each model per worker and attach the shared corpus"
+    global _worker_ranker, _worker_shm
+
+    # split the cores between workers instead of each using all of them
+    import torch
+
+    torch.set_num_threads(n_threads)
+
+    from sentence_transformers import SentenceTransformer
+    from sentence_transformers.cross_encoder import CrossEncoder
+
+    _worker_shm = SharedEmbeddings.attach(*shm_spec)
+    _worker_ranker = RetrieveReranker(
+        corpus=corpus,
+        bi_encoder_model=SentenceTransformer(bi_encoder_name),
+        cross_encoder_model=CrossEncoder(cross_encoder_name),
+        corpus_embed=_worker_shm.array,
+        normalized=True,
+    )
+
+
+def _run_batch(query_strings, number_ranks, number_results):
+    "Results plus the worker's stage timings for this batch, for the parent's report"
+    results = _worker_ranker.query_batch(query_strings, number_ranks, number_results)
+    return results, dict(_worker_ranker.last_timings)
+
+
+class RerankServer:
+    """Serve RetrieveReranker queries from a pool of worker processes.
+
+    Each worker holds its own bi-encoder and cross-encoder, while the corpus
+    embeddings live once in shared memory, L2-normalized so retrieval is a
+    single matmul. Each worker gets `n_threads` torch threads (default: the
+    cores split evenly between workers). Queries arriving within
+    `max_wait_ms` of each other are micro-batched (up to `max_batch_size`)
+    before being sent to a worker.
+
+    `timing_report` merges the retrieve and rerank timings sent back by the
+    workers with the round-trip time of each batch as seen by the server.
+    """
+
+    def __init__(
+        self,
+        corpus,
+        corpus_embed,
+        bi_encoder_name,
+        cross_encoder_name,
+        n_workers=2,
+        max_batch_size=32,
+        max_wait_ms=5,
+        number_ranks=100,
+        n_threads=None,
+    ):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.number_ranks = number_ranks
+
+        n_threads = n_threads or max(1, (os.cpu_count() or 1) // n_workers)
+
+        corpus_embed = np.asarray(corpus_embed, dtype=np.float32)
+        norms = np.linalg.norm(corpus_embed, axis=1, keepdims=True)
+        self.shared_embed = SharedEmbeddings.create(corpus_embed / np.maximum(norms, 1e-12))
+        self.pool = ProcessPoolExecutor(
+            max_workers=n_workers,
+            initializer=_init_worker,
+            initargs=(
+                corpus,
+                self.shared_embed.spec,
+                bi_encoder_name,
+                cross_encoder_name,
+                n_threads,
+            ),
+        )
+
+        self.timer = StageTimer()
+        self._requests = queue.Queue()
+
+        # submit and close hold the lock, so no request can be queued behind
+        # the shutdown sentinel and be left with a future that never resolves
+        self._lock = threading.Lock()
+        self._closed = False
+        self._error = None
+        self._dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+        self._dispatcher.start()
+
+    def submit(self, query_string, number_results=1):
+        "Queue a single query, returning a Future of (index, probability, string)"
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("RerankServer is closed")
+            if self._error is not None:
+                raise RuntimeError("RerankServer worker pool is broken") from self._error
+
+            self._requests.put((query_string, number_results, future))
+
+        return future
+
+    def query(self, query_string, number_results=1):
+        "Blocking query with the same output as RetrieveReranker.query"
+        return self.submit(query_string, number_results).result()
+
+    def _collect_batch(self):
+        "Block for one request, then gather more until the batch is full or the wait expires"
+        first = self._requests.get()
+        if first is None:
+            return None
+
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._requests.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                # put the sentinel back so the loop exits after this batch
+                self._requests.put(None)
+                break
+            batch.append(item)
+
+        return batch
+
+    def _dispatch(self):
+        while True:
+            batch = self._collect_batch()
+            if batch is None:
+                return
+
+            # once the pool is broken, fail everything still arriving rather
+            # than leaving futures that never resolve
+            if self._error is not None:
+                _fail(batch, self._error)
+                continue
+
+            queries = [q for q, _, _ in batch]
+            number_results = max(n for _, n, _ in batch)
+
+            try:
+                job = self.pool.submit(_run_batch, queries, self.number_ranks, number_results)
+            except (BrokenProcessPool, RuntimeError) as e:
+                self._error = e
+                _fail(batch, e)
+                continue
+
+            self.timer.count("batches")
+            self.timer.count("queries", len(batch))
+            self.timer.count("pairs_scored", len(batch) * self.number_ranks)
+            job.add_done_callback(
+                lambda job, batch=batch, start=time.perf_counter(): self._done(job, batch, start)
+            )
+
+    def _done(self, job, batch, start):
+        "Record a finished batch's timings, then resolve its futures"
+        self.timer.add("batch", time.perf_counter() - start)
+        if job.exception() is None:
+            for stage, seconds in job.result()[1].items():
+                self.timer.add(stage, seconds)
+
+        _resolve(job, batch)
+
+    def timing_report(self):
+        """Calls, total seconds and p50/p90/p99 latency for the worker stages
+        (retrieve, rerank) and the server round trip per batch, plus counts of
+        batches, queries and pairs scored"""
+        return self.timer.report()
+
+    def write_report(self, path):
+        "Write `timing_report` as JSON to `path`"
+        return self.timer.write_report(path)
+
+    def close(self):
+        "Stop accepting queries, finish queued batches and release shared memory"
+        with self._lock:
+            if self._closed:
+                return
+
+            self._closed = True
+            self._requests.put(None)
+
+        self._dispatcher.join()
+        self.pool.shutdown(wait=True)
+        self.shared_embed.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _fail(batch, error):
+    for _, _, future in batch:
+        future.set_exception(error)
+
+
+def _resolve(job, batch):
+    "Hand each request in a batch its own slice of the results"
+    error = job.exception()
+    for i, (_, number_results, future) in enumerate(batch):
+        if error is not None:
+            future.set_exception(error)
+        else:
+            res_idx, res_prb, res_str = job.result()[0][i]
+            future.set_result(
+                (
+                    res_idx[:number_results],
+                    res_prb[:number_results],
+                    res_str[:number_results],
+                )
+            )
@@ -1,20 +1,82 @@
+import itertools
+
 import torch
-from torch.utils.data import Dataset
+import numpy as np
+from torch.utils.data import Dataset, Sampler
+
+from .utils import InjuryLabelEncoder
+
+
+def tokenize_compact(texts, tokenizer, max_length, batch_size=1024):
+    """Tokenize texts in blocks, storing unpadded ids in one flat array.
+
+    Returns (input_ids, offsets, lengths): row i is
+    input_ids[offsets[i]:offsets[i + 1]]. Ids are uint16 when the vocabulary
+    fits, so memory stays a few bytes per token rather than a Python int each.
+    """
+    dtype = np.uint16 if len(tokenizer) <= np.iinfo(np.uint16).max else np.int32
+
+    blocks = []
+    lengths = []
+    for i in range(0, len(texts), batch_size):
+        batch = list(texts[i : i + batch_size])
+        rows = tokenizer(batch, truncation=True, padding=False, max_length=max_length)["input_ids"]
+
+        # one array per block, the per-row Python lists are dropped here
+        block_lengths = [len(row) for row in rows]
+        blocks.append(
+            np.fromiter(itertools.chain.from_iterable(rows), dtype=dtype, count=sum(block_lengths))
+        )
+        lengths.extend(block_lengths)
+
+    lengths = np.asarray(lengths, dtype=np.int32)
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    input_ids = np.concatenate(blocks) if blocks else np.zeros(0, dtype=dtype)
+
+    return input_ids, offsets, lengths
 
 
 class CustomDataset(Dataset):
-    def __init__(self, texts, labels, tokenizer, max_length):
+    def __init__(
+        self,
+        texts,
+        labels,
+        tokenizer,
+        max_length,
+        pretokenize=False,
+        tokenize_batch_size=1024,
+    ):
         self.texts = texts
         self.labels = labels
         self.tokenizer = tokenizer
         self.max_length = max_length
+        self.pretokenize = pretokenize
+
+        # tokenize once up front and keep unpadded ids in a flat array
+        if self.pretokenize:
+            self._tokenize_all(tokenize_batch_size)
 
     def __len__(self):
         return len(self.texts)
 
+    def _tokenize_all(self, batch_size):
+        self.input_ids, self.offsets, self.lengths = tokenize_compact(
+            self.texts, self.tokenizer, self.max_length, batch_size
+        )
+
     def __getitem__(self, idx):
-        text = self.texts[idx]
         label = self.labels[idx]
+
+        if self.pretokenize:
+            start, end = self.offsets[idx], self.offsets[idx + 1]
+            input_ids = torch.from_numpy(self.input_ids[start:end].astype(np.int64))
+            return {
+                "input_ids": input_ids,
+                "attention_mask": torch.ones_like(input_ids),
+                "labels": torch.tensor(label, dtype=torch.long),
+            }
+
+        text = self.texts[idx]
         encoding = self.tokenizer(
             text,
             truncation=True,
@@ -29,6 +91,76 @@ class CustomDataset(Dataset):
         }
 
 
+class LengthBucketSampler(Sampler):
+    """Batch sampler that groups samples of similar token length.
+
+    Indices are shuffled, cut into pools of `batch_size * bucket_multiplier`,
+    sorted by length within each pool and split into batches. The batch order
+    is then shuffled, so batches stay random but carry little padding.
+    """
+
+    def __init__(
+        self, lengths, batch_size, bucket_multiplier=50, shuffle=True, seed=None
+    ):
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.bucket_multiplier = bucket_multiplier
+        self.shuffle = shuffle
+        self.rng = np.random.default_rng(seed)
+
+    def __len__(self):
+        return -(-len(self.lengths) // self.batch_size)
+
+    def __iter__(self):
+        if self.shuffle:
+            order = self.rng.permutation(len(self.lengths))
+        else:
+            order = np.arange(len(self.lengths))
+
+        pool_size = self.batch_size * self.bucket_multiplier
+        batches = []
+        for i in range(0, len(order), pool_size):
+            pool = order[i : i + pool_size]
+            pool = pool[np.argsort(self.lengths[pool], kind="stable")]
+            for j in range(0, len(pool), self.batch_size):
+                batches.append(pool[j : j + self.batch_size].tolist())
+
+        if self.shuffle:
+            self.rng.shuffle(batches)
+
+        return iter(batches)
+
+
+class DynamicPaddingCollator:
+    """Pad a batch from a pretokenized CustomDataset to its longest sequence,
+    rounded up to `pad_to_multiple_of`. Items without "labels" give a batch
+    without labels"""
+
+    def __init__(self, pad_token_id, pad_to_multiple_of=8):
+        self.pad_token_id = pad_token_id
+        self.pad_to_multiple_of = pad_to_multiple_of
+
+    def __call__(self, batch):
+        max_len = max(len(item["input_ids"]) for item in batch)
+        if self.pad_to_multiple_of:
+            m = self.pad_to_multiple_of
+            max_len = -(-max_len // m) * m
+
+        input_ids = torch.full((len(batch), max_len), self.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(batch), max_len), dtype=torch.long)
+
+        for i, item in enumerate(batch):
+            n = len(item["input_ids"])
+            input_ids[i, :n] = item["input_ids"]
+            attention_mask[i, :n] = 1
+
+        padded = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "labels" in batch[0]:
+            padded["labels"] = torch.stack([item["labels"] for item in batch])
+
+        return padded
+
+
 def new_input_to_prediction(fitted_model, new_text_input, tokenizer, max_length):
 
     encoded_inputs = tokenizer(
@@ -46,3 +178,58 @@ def new_input_to_prediction(fitted_model, new_text_input, tokenizer, max_length)
         outputs = fitted_model(input_ids, attention_mask)
 
     return outputs
+
+
+def batched_prediction(
+    fitted_model,
+    new_text_input,
+    tokenizer,
+    max_length,
+    batch_size=64,
+    return_labels=False,
+    label_encoder=None,
+):
+    """Score a large list of texts in fixed-size batches.
+
+    Inputs are tokenized in blocks into a compact id array, then sorted by
+    token length so each batch is padded only to its longest member. Logits
+    are returned in the original input order. With `return_labels` the
+    predicted code, label and softmax probability are returned as well,
+    decoded with `label_encoder` (defaults to the `injury_codes` mapping).
+    """
+
+    input_ids, offsets, lengths = tokenize_compact(new_text_input, tokenizer, max_length)
+    order = np.argsort(lengths, kind="stable")
+
+    collate = DynamicPaddingCollator(tokenizer.pad_token_id)
+    fitted_model.eval()
+
+    logits = None
+    with torch.inference_mode():
+        for i in range(0, len(order), batch_size):
+            idx = order[i : i + batch_size]
+            batch = collate(
+                [
+                    {"input_ids": torch.from_numpy(row.astype(np.int64))}
+                    for row in (input_ids[offsets[j] : offsets[j + 1]] for j in idx)
+                ]
+            )
+
+            outputs = fitted_model(batch["input_ids"], batch["attention_mask"])
+            batch_logits = getattr(outputs, "logits", outputs)
+
+            # write back into the original position
+            if logits is None:
+                logits = torch.empty(
+                    (len(lengths), batch_logits.shape[-1]), dtype=batch_logits.dtype
+                )
+            logits[torch.from_numpy(idx)] = batch_logits
+
+    if not return_labels:
+        return logits
+
+    if label_encoder is None:
+        label_encoder = InjuryLabelEncoder()
+    codes, labels, probs = label_encoder.decode_logits(logits.float().numpy())
+
+    return logits, codes[:, 0], labels[:, 0], probs[:, 0]
@@ -1,3 +1,8 @@
+import json
+import os
+
+import numpy as np
+
 injury_codes = {
     50: "Amputation",
     65: "Anoxia",
@@ -29,4 +34,89 @@ injury_codes = {
     64: "Strain or Sprain",
     69: "Submersion (including Drowning)",
     71: "Other/Not Stated"
-}
\ No newline at end of file
+}
+
+
+class LabelEncoder:
+    """Bidirectional map between sparse integer codes (NEISS diagnosis or
+    product codes) and the contiguous class indices used by a classifier.
+    Lookups are a binary search over the sorted codes, so whole batches are
+    encoded/decoded without Python loops and memory does not depend on how
+    large the codes are."""
+
+    FILENAME = "label_map.json"
+
+    def __init__(self, codes):
+        # class index order is the sorted order of the codes
+        self.index_to_code = np.array(sorted(codes), dtype=np.int64)
+        self.index_to_label = np.array([codes[c] for c in self.index_to_code], dtype=object)
+
+    def __len__(self):
+        return len(self.index_to_code)
+
+    def contains(self, codes):
+        "Boolean mask of which codes are in the mapping"
+        codes = np.asarray(codes, dtype=np.int64)
+        pos = np.searchsorted(self.index_to_code, codes)
+        pos = np.minimum(pos, len(self.index_to_code) - 1)
+        return self.index_to_code[pos] == codes
+
+    def encode(self, codes):
+        "Codes -> class indices"
+        codes = np.asarray(codes, dtype=np.int64)
+        if not self.contains(codes).all():
+            raise ValueError("Unknown code in input")
+
+        return np.searchsorted(self.index_to_code, codes)
+
+    def decode(self, indices):
+        "Class indices -> codes"
+        return self.index_to_code[np.asarray(indices, dtype=np.int64)]
+
+    def decode_logits(self, logits, top_k=1):
+        """Decode a batch of logits into (codes, labels, probabilities), each
+        of shape (n_rows, top_k), ordered from most to least likely"""
+        logits = np.asarray(logits, dtype=np.float64)
+
+        # numerically stable softmax
+        probs = np.exp(logits - logits.max(axis=1, keepdims=True))
+        probs /= probs.sum(axis=1, keepdims=True)
+
+        top_k = min(top_k, probs.shape[1])
+        if top_k == 1:
+            top = probs.argmax(axis=1)[:, None]
+        else:
+            top = np.argpartition(-probs, top_k - 1, axis=1)[:, :top_k]
+            order = np.argsort(-np.take_along_axis(probs, top, axis=1), axis=1)
+            top = np.take_along_axis(top, order, axis=1)
+
+        return (
+            self.index_to_code[top],
+            self.index_to_label[top],
+            np.take_along_axis(probs, top, axis=1),
+        )
+
+    def to_config(self):
+        "id2label / label2id dicts for a transformers model config"
+        id2label = {i: str(c) for i, c in enumerate(self.index_to_code)}
+        label2id = {v: k for k, v in id2label.items()}
+        return id2label, label2id
+
+    def save(self, model_dir):
+        "Write the mapping next to the saved model"
+        codes = {int(c): str(l) for c, l in zip(self.index_to_code, self.index_to_label)}
+        with open(os.path.join(model_dir, self.FILENAME), "w") as f:
+            json.dump(codes, f, indent=2)
+
+    @classmethod
+    def load(cls, model_dir):
+        with open(os.path.join(model_dir, cls.FILENAME), "r") as f:
+            codes = {int(k): v for k, v in json.load(f).items()}
+        return cls(codes)
+
+
+class InjuryLabelEncoder(LabelEncoder):
+    "LabelEncoder for the NEISS diagnosis codes"
+
+    def __init__(self, codes=injury_codes):
+        super().__init__(codes)
@@ -1,96 +1,714 @@
+import os
+import tempfile
+import warnings
+
 import numpy as np
 
-from sklearn.ensemble import RandomForestRegressor
+import joblib
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from sklearn.ensemble import (
+    ExtraTreesRegressor,
+    HistGradientBoostingRegressor,
+    RandomForestRegressor,
+)
+from sklearn.linear_model import Ridge
+from sklearn.neighbors import KNeighborsRegressor
 from sklearn.preprocessing import StandardScaler
-from sklearn.model_selection import cross_val_score
+from sklearn.model_selection import KFold
+
+# built-in sub-learners, keyed by the name passed to ALSOe(learner=...)
+LEARNERS = {
+    "random_forest": lambda seed: RandomForestRegressor(n_estimators=10, random_state = seed),
+    "extra_trees": lambda seed: ExtraTreesRegressor(n_estimators=10, bootstrap = True, random_state = seed),
+    "hist_gb": lambda seed: HistGradientBoostingRegressor(max_iter=50, random_state = seed),
+    "ridge": lambda seed: Ridge(),
+    "knn": lambda seed: KNeighborsRegressor(n_neighbors=10),
+}
+
+# learners whose trees can be packed by `save`, and which give out-of-bag
+# predictions when bootstrapped
+PACKABLE = (RandomForestRegressor, ExtraTreesRegressor)
+
+
+def _make_learner(learner, seed):
+    """ Build an unfitted sub-model from a LEARNERS name or an estimator
+    """
+
+    if isinstance(learner, str):
+        if learner not in LEARNERS:
+            raise ValueError(f"Unknown learner '{learner}', choose from {list(LEARNERS)}")
+        return LEARNERS[learner](seed)
+
+    model = clone(learner)
+    if "random_state" in model.get_params():
+        model.set_params(random_state = seed)
+
+    return model
+
+
+def _oob_resid(model, X, y):
+    """ Fit a bootstrapped forest once and return absolute out-of-bag
+    residuals for the rows that were left out of at least one tree
+    """
+
+    model.set_params(oob_score = True)
+    with warnings.catch_warnings():
+        # rows in every bootstrap sample have no oob prediction, they are
+        # masked out below
+        warnings.simplefilter("ignore", UserWarning)
+        model.fit(X, y)
+
+    in_every_tree = np.ones(len(y), dtype = bool)
+    for samples in model.estimators_samples_:
+        in_tree = np.zeros(len(y), dtype = bool)
+        in_tree[samples] = True
+        in_every_tree &= in_tree
+
+    return np.abs(y - model.oob_prediction_)[~in_every_tree]
+
+
+def _cv_resid(learner, X, y, seed, cv):
+    """ Absolute out-of-fold residuals from KFold refits
+    """
+
+    resid = np.empty(len(y))
+    for train, test in KFold(n_splits = cv).split(X):
+        cv_model = _make_learner(learner, seed)
+        cv_model.fit(X[train], y[train])
+        resid[test] = np.abs(y[test] - cv_model.predict(X[test]))
+
+    return resid
+
+
+def _fit_one(X, y, seed, learner = "random_forest", cv = 3):
+    """ Fit a single sub-model and its weight. Module level so it can be
+    sent to a worker
+
+    Bootstrapped forests are fit once and scored on their out-of-bag rows.
+    Other learners are scored with KFold, which costs `cv` extra fits
+    """
+
+    # initalize regressor
+    model = _make_learner(learner, seed)
+
+    resid = None
+    if isinstance(model, PACKABLE) and model.bootstrap:
+        resid = _oob_resid(model, X, y)
+
+    if resid is None or len(resid) == 0:
+        resid = _cv_resid(learner, X, y, seed, cv)
+        model.fit(X, y)
+
+    # held-out rmse; models worse than predicting the mean get zero weight
+    w = 1 - min(1, np.sqrt(np.mean(np.square(resid))))
+
+    # held-out residual stats are used to standardize residuals at
+    # predict time, so scores do not depend on the batch being scored
+    resid_mean = np.mean(resid)
+    resid_std = np.std(resid) or 1.0
+
+    return model, w, resid_mean, resid_std
+
+
+def _in_column_order(df, columns):
+    """ Reorder a frame read with `columns` to the order they were asked for.
+    Readers return selected columns in file order, which would silently
+    misalign features with the fitted scaler and sub-models
+    """
+
+    if columns is None:
+        return df
+
+    columns = list(columns)
+    if all(isinstance(c, (int, np.integer)) for c in columns):
+        # positional selection comes back sorted by position
+        in_file = sorted(columns)
+        return df.iloc[:, [in_file.index(c) for c in columns]]
+
+    return df[columns]
+
+
+def _read_chunks(path, chunk_size, columns = None):
+    """ Stream a csv, parquet or .npy file as float arrays of chunk_size rows.
+    `columns` (names, or positions for csv and .npy) are returned in the
+    order given
+    """
+
+    ext = os.path.splitext(path)[1].lower()
+
+    if ext == ".csv":
+        import pandas as pd
+
+        for df in pd.read_csv(path, chunksize = chunk_size, usecols = columns):
+            yield _in_column_order(df, columns).to_numpy(dtype = float)
+
+    elif ext == ".parquet":
+        import pyarrow.parquet as pq
+
+        parquet = pq.ParquetFile(path)
+        for batch in parquet.iter_batches(batch_size = chunk_size, columns = columns):
+            yield _in_column_order(batch.to_pandas(), columns).to_numpy(dtype = float)
+
+    elif ext == ".npy":
+        data = np.load(path, mmap_mode = "r")
+        for start in range(0, data.shape[0], chunk_size):
+            # slice rows first so only this chunk is read off the memmap
+            chunk = data[start:start + chunk_size]
+            if columns is not None:
+                chunk = chunk[:, columns]
+            yield np.asarray(chunk, dtype = float)
+
+    else:
+        raise ValueError(f"Unsupported file type: {ext}")
+
+
+def _forest_trees(model):
+    """ (left, right, feature, threshold, value, max_depth) of every tree in
+    a fitted forest or a _PackedForest, with tree-local child indices
+    """
+
+    if isinstance(model, _PackedForest):
+        for k in range(len(model.roots)):
+            yield model.tree_arrays(k)
+        return
+
+    for est in model.estimators_:
+        tree = est.tree_
+        yield (tree.children_left, tree.children_right, tree.feature,
+               tree.threshold, tree.value[:, 0, 0], tree.max_depth)
+
+
+def _pack_forests(models):
+    """ Flatten the trees of fitted random or extra-trees forests, or of
+    already packed forests, into shared node arrays. Child indices are
+    global, leaves keep -1, and each model keeps a slice of `roots`
+    pointing at its trees
+    """
+
+    first = models[0]
+    n_features = first.n_features if isinstance(first, _PackedForest) else first.n_features_in_
+
+    left, right, feature, threshold, value = [], [], [], [], []
+    roots, max_depth, model_ptr = [], [], [0]
+    offset = 0
+
+    for model in models:
+        for l, r, f, t, v, depth in _forest_trees(model):
+            left.append(np.where(l == -1, -1, l + offset))
+            right.append(np.where(r == -1, -1, r + offset))
+            feature.append(f)
+            threshold.append(t)
+            value.append(v)
+            roots.append(offset)
+            max_depth.append(depth)
+            offset += len(l)
+        model_ptr.append(len(roots))
+
+    return {
+        "left": np.concatenate(left).astype(np.int32),
+        "right": np.concatenate(right).astype(np.int32),
+        "feature": np.concatenate(feature).astype(np.int32),
+        "threshold": np.concatenate(threshold),
+        "value": np.concatenate(value),
+        "roots": np.asarray(roots, dtype = np.int64),
+        "max_depth": np.asarray(max_depth, dtype = np.int64),
+        "model_ptr": np.asarray(model_ptr, dtype = np.int64),
+        "n_features": n_features,
+    }
+
+
+def _build_tree(n_features, left, right, feature, threshold, value, max_depth):
+    """ A sklearn Tree holding the given nodes, so it predicts in compiled
+    code. Uses sklearn's private Tree pickle state, which copies the nodes
+    """
+
+    from sklearn.tree._tree import NODE_DTYPE, Tree
+
+    nodes = np.zeros(len(left), dtype = NODE_DTYPE)
+    nodes["left_child"] = left
+    nodes["right_child"] = right
+    nodes["feature"] = feature
+    nodes["threshold"] = threshold
+
+    tree = Tree(n_features, np.array([1], dtype = np.intp), 1)
+    tree.__setstate__({
+        "max_depth": int(max_depth),
+        "node_count": len(left),
+        "nodes": nodes,
+        "values": np.ascontiguousarray(value, dtype = np.float64).reshape(-1, 1, 1),
+    })
+
+    return tree
+
+
+class _PackedForest():
+    """ A regression forest read from packed node arrays. `predict` gives
+    the same output as the original forest's predict.
+
+    By default the trees are rebuilt as sklearn Trees, which score as fast
+    as the original forest but copy the nodes into each process. With
+    `shared` the packed arrays are walked directly, so memory-mapped arrays
+    stay one copy shared by every process, at several times the scoring
+    cost (a NumPy pass per tree level instead of compiled tree traversal)
+    """
+
+    def __init__(self, packed, start, stop, shared = False):
+        self.left = packed["left"]
+        self.right = packed["right"]
+        self.feature = packed["feature"]
+        self.threshold = packed["threshold"]
+        self.value = packed["value"]
+        self.n_features = int(packed["n_features"])
+
+        # tree k holds nodes [roots[k], ends[k])
+        all_roots = np.asarray(packed["roots"])
+        self.roots = all_roots[start:stop]
+        self.ends = np.append(all_roots[1:], len(self.left))[start:stop]
+        self.max_depth = np.asarray(packed["max_depth"][start:stop])
+
+        self.trees = None
+        if not shared:
+            self.trees = [
+                _build_tree(self.n_features, *self.tree_arrays(k))
+                for k in range(len(self.roots))
+            ]
+
+    def tree_arrays(self, k):
+        """ Node arrays of tree k, with tree-local child indices
+        """
+
+        r, e = self.roots[k], self.ends[k]
+        left = np.asarray(self.left[r:e])
+        right = np.asarray(self.right[r:e])
+
+        return (np.where(left == -1, -1, left - r), np.where(right == -1, -1, right - r),
+                np.asarray(self.feature[r:e]), np.asarray(self.threshold[r:e]),
+                np.asarray(self.value[r:e]), self.max_depth[k])
+
+    def predict(self, X):
+
+        # sklearn compares float32 features against the stored thresholds
+        X = np.ascontiguousarray(X, dtype = np.float32)
+
+        if self.trees is not None:
+            out = np.zeros(X.shape[0])
+            for tree in self.trees:
+                out += tree.predict(X).reshape(X.shape[0], -1)[:, 0]
+            return out / len(self.trees)
+
+        # walk every (row, tree) pair down one level per pass
+        node = np.tile(self.roots, (X.shape[0], 1))
+        while True:
+            r, t = np.nonzero(self.left[node] != -1)
+            if len(r) == 0:
+                break
+            nd = node[r, t]
+            go_left = X[r, self.feature[nd]] <= self.threshold[nd]
+            node[r, t] = np.where(go_left, self.left[nd], self.right[nd])
+
+        return self.value[node].mean(axis = 1)
+
 
 class ALSOe():
     """ Initializes a regression-based outlier detector
+
+    `learner` picks the sub-model: a key of LEARNERS ("random_forest" by
+    default, "extra_trees", "hist_gb", "ridge", "knn") or any sklearn
+    regressor, which is cloned for every sub-model
     """
 
-    def __init__(self, N = 100) -> None:
+    def __init__(self, N = 100, n_jobs = None, random_state = None,
+                 n_calibration = 5000, chunk_size = 65536,
+                 learner = "random_forest", reservoir_size = 5000) -> None:
 
         self.param_list = []
         self.model_list = []
-        self.anom_list = []
-        self.wt = []
-    
+        self.wt = np.array([])
+        self.resid_mean = np.array([])
+        self.resid_std = np.array([])
+        self.model_age = np.array([], dtype = int)
+        self.score_mean = 0.0
+        self.score_std = 1.0
+
         self.N = N
-        self.std_scaler = StandardScaler()
+        self.n_jobs = n_jobs
+        self.random_state = random_state
+        self.n_calibration = n_calibration
+        self.chunk_size = chunk_size
+        self.learner = learner
+        self.reservoir_size = reservoir_size
+        self.reservoir = None
+        self.n_updates = 0
+
+        # one scaler per model generation (the model_age it was trained at)
+        self.scalers = {}
 
     def fit(self, data):
         """ Fit an ensamble detector
         """
 
         # standardize data
-        self.std_scaler = self.std_scaler.fit(X = data)
-        data = self.std_scaler.transform(data)
+        data = np.asarray(data)
+        self.scalers = {0: StandardScaler().fit(X = data)}
+        scaled = self.scalers[0].transform(data)
+
+        # one generator drives all sampling, so a fixed random_state gives
+        # the same ensemble regardless of n_jobs
+        self._rng = np.random.default_rng(self.random_state)
 
         # fit N models
-        for i in range(0, self.N):
+        self.param_list = []
+        self.model_list = []
+        self.wt = np.array([])
+        self.resid_mean = np.array([])
+        self.resid_std = np.array([])
+        self.model_age = np.array([], dtype = int)
+        self._add_models(scaled, self.N, age = 0)
+
+        # keep a sample of raw rows for later partial_fit refreshes
+        self.reservoir = np.empty((0, data.shape[1]))
+        self.n_updates = 0
+        self._update_reservoir(data)
+
+        # calibrate the final rescaling on (a sample of) the training data
+        self._calibrate(data)
+
+    def _add_models(self, data, n_models, age):
+        """ Fit n_models new sub-models on already-scaled data and append
+        them to the ensemble
+        """
+
+        rng = self._rng
+
+        # define sample space
+        n = data.shape[0]
+        p = data.shape[1]
+        s = [min([n, 50]), min(n,1000)]
 
-            # define sample space
-            n = data.shape[0]
-            p = data.shape[1]
-            s = [min([n, 50]), min(n,1000)]
+        # draw the subsample, target column and seed for each model up front.
+        # Only the subsample is sent to a worker, never the full data
+        tasks = []
+        params = []
+        for i in range(0, n_models):
 
             # draw s random samples from dataframe X
-            s1 = np.random.randint(low = s[0], high = s[1])
-            p1 = np.random.randint(low = 0, high = p)
-            ind = np.random.choice(n, size = s1, replace = False)
+            s1 = rng.integers(low = s[0], high = s[1]) if s[1] > s[0] else s[0]
+            p1 = int(rng.integers(low = 0, high = p))
+            ind = rng.choice(n, size = s1, replace = False)
+            seed = int(rng.integers(np.iinfo(np.int32).max))
+
+            # define random y and X, gathering the subsample and the
+            # remaining columns in a single copy
+            cols = np.delete(np.arange(p), p1)
+            y = data[ind, p1]
+            X = data[np.ix_(ind, cols)]
+
+            tasks.append((X, y, seed))
+            params.append(p1)
+
+        # fit models, in a process pool when n_jobs is set
+        fitted = Parallel(n_jobs = self.n_jobs)(
+            delayed(_fit_one)(X, y, seed, self.learner) for X, y, seed in tasks
+        )
+
+        # weights and residual stats are fixed at fit time, so predict is
+        # pure inference
+        self.param_list = list(self.param_list) + params
+        self.model_list = list(self.model_list) + [f[0] for f in fitted]
+        self.wt = np.concatenate([self.wt, [f[1] for f in fitted]])
+        self.resid_mean = np.concatenate([self.resid_mean, [f[2] for f in fitted]])
+        self.resid_std = np.concatenate([self.resid_std, [f[3] for f in fitted]])
+        self.model_age = np.concatenate([self.model_age, np.full(n_models, age)])
+
+    def _calibrate(self, data):
+        """ Set the final score rescaling from (a sample of) raw data
+        """
+
+        n = data.shape[0]
+        calib = data[self._rng.choice(n, size = min(n, self.n_calibration), replace = False)]
+        calib_score = self._raw_score(calib)
+        self.score_mean = np.mean(calib_score)
+        self.score_std = np.std(calib_score) or 1.0
+
+    def _update_reservoir(self, data):
+        """ Add raw rows to the reservoir. It fills up first, then each new
+        row overwrites a random slot, so the sample leans towards recent rows
+        (a row survives for roughly reservoir_size later rows)
+        """
+
+        space = max(0, self.reservoir_size - self.reservoir.shape[0])
+        self.reservoir = np.vstack([self.reservoir, data[:space]])
+
+        rest = data[space:]
+        if len(rest):
+            slots = self._rng.integers(self.reservoir_size, size = len(rest))
+            self.reservoir[slots] = rest
+
+    def partial_fit(self, data, n_replace = None, retire = "weight"):
+        """ Refresh a fitted ensemble with new rows instead of refitting.
+
+        `n_replace` sub-models (default 10% of N) are retired and replaced
+        by models trained on the reservoir of recent rows, keeping the size
+        at N. `retire` is "weight" (drop the lowest-weighted models) or
+        "age" (drop the oldest).
+
+        Every sub-model keeps the scaler of the generation it was trained in
+        (`scalers[model_age]`), so retained models and their residual stats
+        are scored exactly as before. Replacements get a new scaler fit on
+        the reservoir, so they track recent data rather than all history,
+        and the final rescaling is recalibrated on the reservoir
+        """
+
+        if not self.model_list:
+            self.fit(data)
+            return self
+
+        if retire not in ("weight", "age"):
+            raise ValueError("retire must be 'weight' or 'age'")
+
+        if not hasattr(self, "_rng"):
+            self._rng = np.random.default_rng(self.random_state)
 
-            # define random y and X 
-            df = data[ind]
-            y = df[:,p1]
-            X = np.delete(df, p1, axis=1)
+        data = np.asarray(data)
+        n_replace = min(n_replace or max(1, self.N // 10), len(self.model_list))
+        self.n_updates += 1
 
-            # initalize RF regressor
-            rf = RandomForestRegressor(n_estimators=10)
+        # refresh the sample of recent rows
+        self._update_reservoir(data)
 
-            # fit & predict
-            rf.fit(X, y)
+        # retire models, keeping the survivors in their original order
+        if retire == "weight":
+            drop = np.argsort(self.wt, kind = "stable")[:n_replace]
+        else:
+            drop = np.argsort(self.model_age, kind = "stable")[:n_replace]
+        keep = np.setdiff1d(np.arange(len(self.model_list)), drop)
 
-            # add fitted models & y param to list
-            self.model_list.append(rf)
-            self.param_list.append(p1)
+        self.param_list = [self.param_list[k] for k in keep]
+        self.model_list = [self.model_list[k] for k in keep]
+        self.wt = self.wt[keep]
+        self.resid_mean = self.resid_mean[keep]
+        self.resid_std = self.resid_std[keep]
+        self.model_age = self.model_age[keep]
+
+        # train replacements on the reservoir, scaled with its own statistics
+        scaler = StandardScaler().fit(self.reservoir)
+        self.scalers[self.n_updates] = scaler
+        recent = scaler.transform(self.reservoir)
+        self._add_models(recent, self.N - len(self.model_list), age = self.n_updates)
+
+        # forget the scalers of fully retired generations, then recalibrate
+        live = set(self.model_age.tolist())
+        self.scalers = {g: sc for g, sc in self.scalers.items() if g in live}
+        self._calibrate(self.reservoir)
+
+        return self
+
+    def _groups(self):
+        """ {generation: [(target column, model indices)]}. Models of one
+        generation share a scaler, and within it those that share a target
+        column share a reduced feature matrix
+        """
+
+        param_arr = np.asarray(self.param_list)
+        age_arr = np.asarray(self.model_age)
+
+        groups = {}
+        for g in np.unique(age_arr):
+            in_gen = age_arr == g
+            groups[int(g)] = [
+                (j, np.flatnonzero(in_gen & (param_arr == j)))
+                for j in np.unique(param_arr[in_gen])
+            ]
+
+        return groups
+
+    def _group_resid(self, data, j, models, out):
+        """ Absolute residuals for every model predicting column j, written
+        into the matching columns of `out`
+        """
+
+        # build the reduced feature matrix once per target column, rather
+        # than once per model
+        y = data[:,j]
+        X = np.delete(data, j, axis=1)
+
+        for k in models:
+            np.subtract(y, self.model_list[k].predict(X), out = out[:,k])
+            np.abs(out[:,k], out = out[:,k])
+
+    def _raw_score(self, data):
+        """ Weighted mean of standardized residuals for raw data.
+        Keeps no state between calls and works for any number of rows.
+        Rows are scored in chunks through one (chunk_size x N) buffer, and
+        each chunk is scaled once per model generation, one at a time, so
+        memory is bounded whatever the input size
+        """
+
+        n = data.shape[0]
+        groups = self._groups()
+        score = np.empty(n)
+        buf = np.empty((min(n, self.chunk_size), len(self.model_list)))
+
+        # sklearn tree predict releases the GIL, so groups can run in threads
+        with Parallel(n_jobs = self.n_jobs, backend = "threading") as parallel:
+            for start in range(0, n, self.chunk_size):
+                block = data[start:start + self.chunk_size]
+                out = buf[:block.shape[0]]
+
+                for g, gen_groups in groups.items():
+                    scaled = self.scalers[g].transform(block)
+                    parallel(
+                        delayed(self._group_resid)(scaled, j, models, out)
+                        for j, models in gen_groups
+                    )
+
+                # standardize with training stats, then weighted mean
+                out -= self.resid_mean
+                out /= self.resid_std
+                score[start:start + block.shape[0]] = out @ self.wt / out.shape[1]
+
+        return score
 
     def predict(self, newdata):
 
         """ Get anomaly scores from fitted models
         """
 
-        # standardize data
-        newdata = self.std_scaler.transform(newdata)    
+        # each generation of models standardizes with its own scaler
+        anom_score = self._raw_score(np.asarray(newdata))
 
-        for i,j in zip(self.model_list, self.param_list):
+        # rescale with the training score distribution and export
+        anom_score = (anom_score - self.score_mean) / self.score_std
 
-            # define X, y
-            y = newdata[:,j]
-            X = np.delete(newdata, j, axis=1)
+        return anom_score
 
-            # get predictions on model i, dropping feature j
-            yhat = i.predict(X)
+    def predict_chunks(self, chunks):
+        """ Score an iterable of row blocks, yielding one score array per
+        block. Uses fit-time scaling, so results match a single predict call
+        """
 
-            # rmse
-            resid = np.sqrt(np.square(y - yhat))
-            resid = (resid - np.mean(resid)) / np.std(resid) 
+        for chunk in chunks:
+            yield self.predict(np.asarray(chunk))
 
-            # compute and apply weights
-            cve = cross_val_score(i, X, y, cv=3, scoring='neg_root_mean_squared_error')
-            w = 1 - min(1, np.mean(cve)*-1)
+    def score_file(self, path, out_path, chunk_size = None, columns = None):
+        """ Score a csv, parquet or .npy file that may not fit in memory,
+        appending one score per row to a csv at out_path. Returns the number
+        of rows scored
+        """
 
-            resid = resid*w
+        chunk_size = chunk_size or self.chunk_size
+        n_rows = 0
 
-            # add weights and preds to lists
-            self.wt.append(w)
-            self.anom_list.append(resid)
+        with open(out_path, "w") as f:
+            f.write("score\n")
+            for score in self.predict_chunks(_read_chunks(path, chunk_size, columns)):
+                np.savetxt(f, score, fmt = "%.6f")
+                n_rows += len(score)
 
-        # export results as min-max scaled
-        anom_score = np.array(self.anom_list).T
-        anom_score = np.mean(anom_score, axis = 1)
+        return n_rows
 
-        # rescale and export
-        anom_score = StandardScaler().fit_transform(anom_score.reshape(-1,1))
-        anom_score = anom_score.flatten()
+    def save(self, path, compress = 0, include_reservoir = False):
+        """ Write the fitted ensemble to a single joblib file. Forests are
+        packed into flat node arrays, including forests that were themselves
+        loaded from a packed file, so load/save round trips do not grow the
+        file. Leave compress at 0 to allow load to memory-map them. Compression gives a smaller file but is always
+        loaded into memory. The file is replaced atomically, so it is safe
+        to save over a file that scoring processes have loaded.
 
-        return anom_score
+        The reservoir of raw training rows is only written with
+        include_reservoir=True, so files shipped to scoring workers hold no
+        raw records. Without it a loaded ensemble starts partial_fit with an
+        empty reservoir, filled from the rows it is given
+        """
+
+        state = {
+            "version": 2,
+            "params": {
+                "N": self.N,
+                "n_jobs": self.n_jobs,
+                "random_state": self.random_state,
+                "n_calibration": self.n_calibration,
+                "chunk_size": self.chunk_size,
+                "learner": self.learner,
+                "reservoir_size": self.reservoir_size,
+            },
+            "scalers": self.scalers,
+            "param_list": np.asarray(self.param_list),
+            "wt": self.wt,
+            "resid_mean": self.resid_mean,
+            "resid_std": self.resid_std,
+            "score_mean": self.score_mean,
+            "score_std": self.score_std,
+            "model_age": self.model_age,
+            "n_updates": self.n_updates,
+        }
+
+        if include_reservoir:
+            state["reservoir"] = self.reservoir
+
+        # forests loaded from a packed file are repacked too, also when
+        # partial_fit has mixed them with newly fitted forests
+        if all(isinstance(m, PACKABLE + (_PackedForest,)) for m in self.model_list):
+            state["forests"] = _pack_forests(self.model_list)
+        else:
+            state["models"] = self.model_list
+
+        # write a temp file next to `path` and swap it in. Rewriting the file
+        # in place would crash any process that has it memory-mapped, while
+        # a replaced file stays valid for mappings of the old one
+        fd, tmp_path = tempfile.mkstemp(
+            dir = os.path.dirname(os.path.abspath(path)),
+            prefix = os.path.basename(path) + ".",
+            suffix = ".tmp",
+        )
+        os.close(fd)
+        try:
+            joblib.dump(state, tmp_path, compress = compress)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path, mmap_mode = "r", shared_trees = False):
+        """ Load an ensemble written by `save`. With mmap_mode set, tree node
+        arrays are memory-mapped rather than read into memory.
+
+        Packed forests are rebuilt as sklearn trees by default, so they score
+        as fast as the fitted forests, but each process holds its own copy of
+        the nodes. With shared_trees=True scoring walks the memory-mapped
+        arrays directly, so every process shares one copy, but predict is
+        several times slower than sklearn
+        """
+
+        state = joblib.load(path, mmap_mode = mmap_mode)
+
+        ad = cls(**state["params"])
+        ad.param_list = [int(j) for j in state["param_list"]]
+        ad.wt = np.asarray(state["wt"])
+        ad.resid_mean = np.asarray(state["resid_mean"])
+        ad.resid_std = np.asarray(state["resid_std"])
+        ad.score_mean = state["score_mean"]
+        ad.score_std = state["score_std"]
+        ad.model_age = np.asarray(state["model_age"])
+
+        ad.scalers = state["scalers"]
+        if "reservoir" in state:
+            ad.reservoir = np.array(state["reservoir"])
+        else:
+            n_cols = next(iter(ad.scalers.values())).n_features_in_
+            ad.reservoir = np.empty((0, n_cols))
+        ad.n_updates = state["n_updates"]
+
+        if "forests" in state:
+            packed = state["forests"]
+            ptr = packed["model_ptr"]
+            ad.model_list = [
+                _PackedForest(packed, ptr[k], ptr[k + 1], shared = shared_trees)
+                for k in range(len(ptr) - 1)
+            ]
+        else:
+            ad.model_list = state["models"]
+
+        return ad
@@ -0,0 +1,67 @@
+"""Compare per-model np.delete copies against per-column grouping in ALSOe
+
+Run from posts/outlier-ensemble with: python -m benchmarks.copies
+"""
+
+import time
+import tracemalloc
+
+import numpy as np
+
+from alsoe import ALSOe
+
+N_ROWS = 100_000
+N_FEATURES = 50
+N_MODELS = 100
+
+
+def per_model_score(ad, data):
+    """ The previous scoring loop: one reduced copy of the data per model
+    """
+
+    score = np.zeros(data.shape[0])
+    for k, j in enumerate(ad.param_list):
+        y = data[:,j]
+        X = np.delete(data, j, axis=1)
+        resid = np.abs(y - ad.model_list[k].predict(X))
+        score += ad.wt[k] * (resid - ad.resid_mean[k]) / ad.resid_std[k]
+
+    return score / len(ad.model_list)
+
+
+def measure(func, *args):
+    "Wall time and peak traced allocation of one call"
+    tracemalloc.start()
+    start = time.perf_counter()
+    out = func(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return out, elapsed, peak
+
+
+def main():
+    rng = np.random.default_rng(0)
+    data = rng.standard_normal((N_ROWS, N_FEATURES))
+
+    ad = ALSOe(N = N_MODELS, n_jobs = -1, random_state = 0)
+    ad.fit(data[:5000])
+    scaled = ad.scalers[0].transform(data)
+
+    copy_bytes = scaled.nbytes * (N_FEATURES - 1) / N_FEATURES
+    n_cols = len(np.unique(ad.param_list))
+
+    old, old_time, old_peak = measure(per_model_score, ad, scaled)
+    new, new_time, new_peak = measure(ad._raw_score, data)
+    assert np.allclose(old, new)
+
+    print(f"{N_ROWS} rows x {N_FEATURES} features, {N_MODELS} models")
+    print(f"per-model : {N_MODELS:4d} copies, {N_MODELS * copy_bytes / 1e9:6.2f} GB copied, "
+          f"{old_time:6.2f}s, peak {old_peak / 1e6:7.1f} MB")
+    print(f"per-column: {n_cols:4d} copies, {n_cols * copy_bytes / 1e9:6.2f} GB copied, "
+          f"{new_time:6.2f}s, peak {new_peak / 1e6:7.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
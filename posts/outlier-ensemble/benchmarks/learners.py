@@ -0,0 +1,60 @@
+"""Fit/predict time and detection quality of each ALSOe sub-learner
+
+Uses the ADBench 'Classical' datasets from alsoe_ensembling.qmd.
+Run from posts/outlier-ensemble with:
+
+    python -m benchmarks.learners path/to/Classical
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+from sklearn.metrics import average_precision_score, roc_auc_score
+
+from alsoe import ALSOe, LEARNERS
+
+DATASETS = {
+    "Cardio": "6_cardio.npz",
+    "Glass": "14_glass.npz",
+    "Ionosphere": "18_Ionosphere.npz",
+    "Letter": "20_letter.npz",
+    "Lympho": "21_Lymphography.npz",
+}
+
+
+def run_one(X, y, learner, seed):
+    ad = ALSOe(N = 100, random_state = seed, learner = learner)
+
+    start = time.perf_counter()
+    ad.fit(X)
+    fit_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    preds = ad.predict(X)
+    predict_time = time.perf_counter() - start
+
+    return fit_time, predict_time, roc_auc_score(y, preds), average_precision_score(y, preds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__)
+    parser.add_argument("data_dir", help = "directory with the ADBench Classical .npz files")
+    parser.add_argument("--repeats", type = int, default = 3)
+    args = parser.parse_args()
+
+    print(f"{'dataset':<11}{'learner':<15}{'fit s':>8}{'predict s':>11}{'RocAUC':>9}{'Prn':>8}")
+    for name, filename in DATASETS.items():
+        data = np.load(os.path.join(args.data_dir, filename))
+        X, y = data["X"], data["y"]
+
+        for learner in LEARNERS:
+            runs = np.array([run_one(X, y, learner, seed) for seed in range(args.repeats)])
+            fit_time, predict_time, auc, pre = runs.mean(axis = 0)
+
+            print(f"{name:<11}{learner:<15}{fit_time:8.2f}{predict_time:11.2f}{auc:9.3f}{pre:8.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Check ALSOe save/load round trips and packed-forest scoring speed
+
+Saves a fitted ensemble, then checks that load -> save and
+load -> partial_fit -> save do not grow the file, and times predict for the
+fitted forests, rebuilt trees and shared (memory-mapped) trees.
+
+Run from posts/outlier-ensemble with: python -m benchmarks.save_load
+"""
+
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from alsoe import ALSOe
+
+N_ROWS = 20_000
+N_FEATURES = 20
+N_MODELS = 30
+
+# a refreshed file holds the same number of similar trees, allow for the
+# replacements being a little larger or smaller than the models they retire
+MAX_GROWTH = 1.5
+
+
+def timed_predict(ad, data):
+    start = time.perf_counter()
+    score = ad.predict(data)
+    return score, time.perf_counter() - start
+
+
+def main():
+    rng = np.random.default_rng(0)
+    data = rng.standard_normal((N_ROWS, N_FEATURES))
+
+    ad = ALSOe(N = N_MODELS, n_jobs = -1, random_state = 0)
+    ad.fit(data[:5000])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        fitted_path = os.path.join(tmp, "fitted.joblib")
+        ad.save(fitted_path)
+        size = os.path.getsize(fitted_path)
+
+        # a plain round trip repacks the loaded trees
+        round_trip_path = os.path.join(tmp, "round_trip.joblib")
+        ALSOe.load(fitted_path).save(round_trip_path)
+        round_trip_size = os.path.getsize(round_trip_path)
+
+        # a refresh mixes loaded and newly fitted forests
+        refreshed_path = os.path.join(tmp, "refreshed.joblib")
+        refreshed = ALSOe.load(fitted_path)
+        refreshed.partial_fit(data[5000:10000])
+        refreshed.save(refreshed_path)
+        refreshed_size = os.path.getsize(refreshed_path)
+
+        print(f"fitted     : {size / 1e6:8.2f} MB")
+        print(f"round trip : {round_trip_size / 1e6:8.2f} MB")
+        print(f"refreshed  : {refreshed_size / 1e6:8.2f} MB")
+        assert round_trip_size <= size * 1.01, "load -> save grew the file"
+        assert refreshed_size <= size * MAX_GROWTH, "load -> partial_fit -> save grew the file"
+
+        fitted, fitted_time = timed_predict(ad, data)
+        rebuilt, rebuilt_time = timed_predict(ALSOe.load(fitted_path), data)
+        shared, shared_time = timed_predict(ALSOe.load(fitted_path, shared_trees = True), data)
+        assert np.allclose(fitted, rebuilt) and np.allclose(fitted, shared)
+
+    print(f"{N_ROWS} rows x {N_FEATURES} features, {N_MODELS} models")
+    print(f"fitted forests: {fitted_time:6.2f}s")
+    print(f"rebuilt trees : {rebuilt_time:6.2f}s")
+    print(f"shared trees  : {shared_time:6.2f}s")
+
+
+if __name__ == "__main__":
+    main()
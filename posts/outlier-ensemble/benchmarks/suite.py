@@ -0,0 +1,183 @@
+"""Scaling benchmark for the ALSOe implementations
+
+Sweeps rows, features and ensemble size on synthetic data with planted
+outliers (plus the blog's ADBench datasets if --data-dir is given). Fit
+time, predict time, peak RSS and ROC AUC are recorded for alsoe.py and
+ensamble_funcs.py. Each run is in a fresh process so peak RSS is per run.
+Results go to CSV and JSON, tagged with the current git commit.
+
+Run from posts/outlier-ensemble with:
+
+    python -m benchmarks.suite --rows 1000 10000 --features 10 50 --models 25 100
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+IMPLEMENTATIONS = ["alsoe", "ensamble_funcs"]
+BLOG_DATASETS = {
+    "cardio": "6_cardio.npz",
+    "glass": "14_glass.npz",
+    "ionosphere": "18_Ionosphere.npz",
+    "letter": "20_letter.npz",
+    "lympho": "21_Lymphography.npz",
+}
+
+
+def make_data(n, p, contamination = 0.05, seed = 0):
+    """ Correlated inliers from a low-rank model plus outliers that break
+    the correlation on a few features. Returns X and 0/1 labels
+    """
+
+    rng = np.random.default_rng(seed)
+    rank = max(1, p // 5)
+
+    loadings = rng.standard_normal((rank, p))
+    X = rng.standard_normal((n, rank)) @ loadings + 0.3 * rng.standard_normal((n, p))
+
+    y = np.zeros(n, dtype = int)
+    n_out = max(1, int(n * contamination))
+    out_rows = rng.choice(n, size = n_out, replace = False)
+    y[out_rows] = 1
+
+    # shift a few features of each outlier away from what the others imply
+    for r in out_rows:
+        cols = rng.choice(p, size = max(1, p // 10), replace = False)
+        X[r, cols] += rng.choice([-1, 1], size = len(cols)) * rng.uniform(3, 6, size = len(cols))
+
+    return X, y
+
+
+def load_dataset(name, n, p, data_dir):
+    if name == "synthetic":
+        return make_data(n, p)
+
+    data = np.load(os.path.join(data_dir, BLOG_DATASETS[name]))
+    return data["X"], data["y"]
+
+
+def peak_rss_mb():
+    """ Peak resident memory of this process in MB, or None if unavailable
+    """
+
+    try:
+        import resource
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on linux, bytes on macos
+        return peak / 1024**2 if sys.platform == "darwin" else peak / 1024
+    except ImportError:
+        pass
+
+    try:
+        import psutil
+
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss) / 1024**2
+    except ImportError:
+        return None
+
+
+def run_one(config):
+    """ Fit and score one configuration. Runs in its own process
+    """
+
+    from sklearn.metrics import roc_auc_score
+
+    if config["impl"] == "alsoe":
+        from alsoe import ALSOe
+    else:
+        from ensamble_funcs import ALSOe
+
+    X, y = load_dataset(config["dataset"], config["n"], config["p"], config["data_dir"])
+
+    ad = ALSOe(N = config["N"])
+
+    start = time.perf_counter()
+    ad.fit(X)
+    fit_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    preds = ad.predict(X)
+    predict_time = time.perf_counter() - start
+
+    return {
+        "impl": config["impl"],
+        "dataset": config["dataset"],
+        "n": X.shape[0],
+        "p": X.shape[1],
+        "N": config["N"],
+        "fit_s": round(fit_time, 4),
+        "predict_s": round(predict_time, 4),
+        "peak_rss_mb": peak_rss_mb(),
+        "roc_auc": round(roc_auc_score(y, preds), 4),
+    }
+
+
+def git_commit():
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output = True, text = True
+        )
+        return out.stdout.strip() or "unknown"
+    except OSError:
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type = int, nargs = "+", default = [1000, 10000])
+    parser.add_argument("--features", type = int, nargs = "+", default = [10, 50])
+    parser.add_argument("--models", type = int, nargs = "+", default = [25, 100])
+    parser.add_argument("--impl", nargs = "+", choices = IMPLEMENTATIONS, default = IMPLEMENTATIONS)
+    parser.add_argument("--data-dir", help = "directory with the ADBench Classical .npz files")
+    parser.add_argument("--out", default = "benchmarks/results", help = "output directory")
+    args = parser.parse_args()
+
+    configs = [
+        {"impl": impl, "dataset": "synthetic", "n": n, "p": p, "N": N, "data_dir": None}
+        for impl, n, p, N in itertools.product(args.impl, args.rows, args.features, args.models)
+    ]
+    if args.data_dir:
+        configs += [
+            {"impl": impl, "dataset": name, "n": None, "p": None, "N": N, "data_dir": args.data_dir}
+            for impl, name, N in itertools.product(args.impl, BLOG_DATASETS, args.models)
+        ]
+
+    # a fresh spawned process per run keeps peak RSS from carrying over
+    ctx = multiprocessing.get_context("spawn")
+    results = []
+    with ctx.Pool(1, maxtasksperchild = 1) as pool:
+        for config in configs:
+            result = pool.apply(run_one, (config,))
+            results.append(result)
+            print(json.dumps(result))
+
+    commit = git_commit()
+    os.makedirs(args.out, exist_ok = True)
+    stem = os.path.join(args.out, f"alsoe_{commit}")
+
+    with open(f"{stem}.csv", "w", newline = "") as f:
+        writer = csv.DictWriter(f, fieldnames = list(results[0]))
+        writer.writeheader()
+        writer.writerows(results)
+
+    with open(f"{stem}.json", "w") as f:
+        meta = {"commit": commit, "run_date": datetime.now().isoformat(timespec = "seconds")}
+        json.dump({"meta": meta, "results": results}, f, indent = 2)
+
+    print(f"wrote {stem}.csv and {stem}.json")
+
+
+if __name__ == "__main__":
+    main()
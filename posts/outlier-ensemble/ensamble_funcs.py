@@ -62,6 +62,9 @@ class ALSOe():
         # standardize data
         newdata = self.std_scaler.transform(newdata)    
 
+        # start from an empty list so earlier calls are not averaged in
+        self.anom_list = []
+
         for i,j in zip(self.model_list, self.param_list):
 
             # define X, y
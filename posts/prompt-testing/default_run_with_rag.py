@@ -1,13 +1,21 @@
-import pandas as pd
 import json
+import pandas as pd
 from datetime import datetime
 
-from openai import OpenAI
 from src.prompts import HEADER1, BODY2, EXAMPLE_OUTPUT2
+from src.narratives import prepare_narratives, token_savings
 from src.prompt_creation import Prompt
+from src.response_cache import ResponseCache, split_cached, write_jsonl
+from src.timing import profile, span, write_report
+from src.token_budget import check_batch, format_estimate
+
+# tags this experiment's files, pass it to collect_batch.py --run so results
+# are matched to this script's requests, not another experiment's
+RUN_NAME = "rag"
 
-client = OpenAI()
-run_date = datetime.now().strftime("%Y-%m-%d")
+# stop before upload if the batch goes over these (None = no limit)
+BATCH_MAX_INPUT_TOKENS = None
+BATCH_MAX_COST_USD = None
 
 # set up prompt
 prompt_creator = Prompt()
@@ -18,69 +26,99 @@ Do NOT deviate from the instructions. If coding rules are present you may use th
 Do NOT rely solely on the rules.
 """
 
-# load suicide narratives and labels
-narratives = pd.read_csv("data/train_narratives_sample_200.csv")
-labels = pd.read_csv("data/train_labels_sample_200.csv")
-
-
-# Execute 1 version of prompt with RAG
-json_list = []
-
-for row in narratives.iterrows():
-
-    # grab the unique id and text
-    single_narrative = row[1]
-    id = single_narrative["uid"]
-    txt = single_narrative["NarrativeLE"] + single_narrative["NarrativeCME"]
-
-    prompt_input = {
-        "header": HEADER1,
-        "narrative": txt,
-        "body": BODY2,
-        "example_output": EXAMPLE_OUTPUT2,
-        "footer": None,
-        "include_rag": True
-    }
-
-    # create a prompt, pass in the text narrative
-    prompt_versions = prompt_creator.standard_prompt_caching(**prompt_input)
-
-    version_num = 0
-    for prompt in prompt_versions:
-        # now append to list
-        json_list.append(
-            {
-                "custom_id": f"{id}_{version_num}",
-                "method": "POST",
-                "url": "/v1/chat/completions",
-                "body": {
-                    "model": "gpt-4o-mini",
-                    "messages": [
-                        {"role": "system", "content": ROLE},
-                        {"role": "user", "content": prompt},
-                    ],
-                    "max_tokens": 500,
-                    "response_format": { "type": "json_object" },
-                },
-            }
-        )
-        version_num += 1
-
-
-with open(f"json/output_{run_date}.jsonl", "w") as outfile:
-    for entry in json_list:
-        json.dump(entry, outfile)
-        outfile.write("\n")
-
-# upload batch to openai
-batch_input_file = client.files.create(
-    file=open(f"json/output_{run_date}.jsonl", "rb"), purpose="batch"
-)
-
-batch_input_file_id = batch_input_file.id
-client.batches.create(
-    input_file_id=batch_input_file_id,
-    endpoint="/v1/chat/completions",
-    completion_window="24h",
-    metadata={"description": "Batch Testing 1 prompt x 200 examples with caching and RAG"},
-)
+
+def main():
+    run_date = datetime.now().strftime("%Y-%m-%d")
+
+    # load suicide narratives and labels
+    narratives = pd.read_csv("data/train_narratives_sample_200.csv")
+    labels = pd.read_csv("data/train_labels_sample_200.csv")
+
+
+    # Execute 1 version of prompt with RAG
+    json_list = []
+
+    # merge the narrative fields without repeated sentences, and send each
+    # distinct narrative once. Results are fanned out to duplicates on collect
+    unique, duplicates = prepare_narratives(narratives)
+    with open(f"json/duplicates_{RUN_NAME}_{run_date}.json", "w") as f:
+        json.dump(duplicates, f)
+
+    raw_texts = narratives["NarrativeLE"].fillna("") + narratives["NarrativeCME"].fillna("")
+    savings = token_savings(raw_texts.tolist(), unique)
+    print(
+        f"{savings['sent']} of {savings['narratives']} narratives sent, "
+        f"{savings['tokens_saved']:,} of {savings['tokens_before']:,} narrative tokens saved"
+    )
+
+    for id, txt in unique:
+        prompt_input = {
+            "header": HEADER1,
+            "narrative": txt,
+            "body": BODY2,
+            "example_output": EXAMPLE_OUTPUT2,
+            "footer": None,
+            "include_rag": True
+        }
+
+        # create a prompt, pass in the text narrative
+        prompt_versions = prompt_creator.standard_prompt_caching(**prompt_input)
+
+        version_num = 0
+        for prompt in prompt_versions:
+            # now append to list
+            json_list.append(
+                {
+                    "custom_id": f"{id}_{version_num}",
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": {
+                        "model": "gpt-4o-mini",
+                        "messages": [
+                            {"role": "system", "content": ROLE},
+                            {"role": "user", "content": prompt},
+                        ],
+                        "max_tokens": 500,
+                        "response_format": { "type": "json_object" },
+                    },
+                }
+            )
+            version_num += 1
+
+    # only submit requests without a cached response, cached results are
+    # written alongside in the batch output format
+    json_list, cached = split_cached(json_list, ResponseCache())
+    write_jsonl(cached, f"json/cached_{RUN_NAME}_{run_date}.jsonl")
+    print(f"{len(cached)} cached, {len(json_list)} to submit")
+    if not json_list:
+        return
+
+    with span("json.serialize"):
+        write_jsonl(json_list, f"json/output_{RUN_NAME}_{run_date}.jsonl")
+    estimate = check_batch(
+        f"json/output_{RUN_NAME}_{run_date}.jsonl", BATCH_MAX_INPUT_TOKENS, BATCH_MAX_COST_USD
+    )
+    print(format_estimate(estimate))
+
+    # upload batch to openai
+    from openai import OpenAI
+
+    client = OpenAI()
+    batch_input_file = client.files.create(
+        file=open(f"json/output_{RUN_NAME}_{run_date}.jsonl", "rb"), purpose="batch"
+    )
+
+    batch_input_file_id = batch_input_file.id
+    client.batches.create(
+        input_file_id=batch_input_file_id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+        metadata={"description": "Batch Testing 1 prompt x 200 examples with caching and RAG"},
+    )
+
+
+if __name__ == "__main__":
+    run_date = datetime.now().strftime("%Y-%m-%d")
+    with profile(f"json/profile_{RUN_NAME}_{run_date}"):
+        main()
+    write_report(f"json/timing_{RUN_NAME}_{run_date}.json")
@@ -0,0 +1,83 @@
+"""Check module import times with `python -X importtime`
+
+Each module is imported in a fresh interpreter from its own post directory.
+The cumulative import time and the heaviest dependencies are reported, and
+the exit code is non-zero if any module goes over the budget. Importing a
+module should never pull in torch, faiss or sentence_transformers.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+POSTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = {
+    "prompt-testing": [
+        "src.prompts",
+        "src.rag",
+        "src.narratives",
+        "src.prompt_creation",
+        "index_rules",
+        "default_run",
+        "default_run_with_rag",
+        "collect_batch",
+        "prefix_cache",
+    ],
+    "uv-testing": [
+        "product_index",
+        "prepare_batch",
+        "process_batch",
+    ],
+}
+HEAVY = ("torch", "faiss", "sentence_transformers", "transformers")
+
+
+def import_time(post, module):
+    """Return (cumulative ms, {package: cumulative ms}) for one import"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=os.path.join(POSTS_DIR, post),
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"importing {module} failed:\n{result.stderr[-2000:]}")
+
+    # lines look like: "import time:   self [us] | cumulative | imported package"
+    packages = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        packages[name.strip()] = int(cumulative) / 1000
+
+    return packages.get(module, 0.0), packages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--budget-ms", type=float, default=1000)
+    parser.add_argument("--top", type=int, default=5)
+    args = parser.parse_args()
+
+    failed = False
+    for post, modules in MODULES.items():
+        for module in modules:
+            total, packages = import_time(post, module)
+            heavy = sorted(p for p in packages if p.split(".")[0] in HEAVY)
+            over = total > args.budget_ms or bool(heavy)
+            failed |= over
+
+            print(f"{post}/{module}: {total:.0f} ms{'  OVER BUDGET' if over else ''}")
+            top = sorted(packages.items(), key=lambda kv: kv[1], reverse=True)
+            for name, ms in top[1 : args.top + 1]:
+                print(f"    {ms:8.1f} ms  {name}")
+            if heavy:
+                print(f"    heavy imports at module load: {', '.join(heavy[:5])}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,13 @@
 "Code to index rules from the NVDRS and store as vector store in cache"
 
 from pypdf import PdfReader
+from src.timing import profile, write_report
 from src.rag import (
     extract_pages,
     chunk_by_subsections_with_codes,
     encode_chunks,
     create_vector_store,
+    build_variable_rule_cache,
 )
 
 # import the full nvdrs coding manual
@@ -15,11 +17,21 @@ page_min = 74
 page_max = 148
 cache_dir = "cache/"
 
-reader = PdfReader("reference/nvdrsCodingManual.pdf")
 
-# extract pages, chunk subsections, then store in cache
+def main():
+    reader = PdfReader("reference/nvdrsCodingManual.pdf")
 
-pages_circumstances = extract_pages(reader, page_min, page_max)
-section_circumstances = chunk_by_subsections_with_codes(pages_circumstances)
-section_embeddings = encode_chunks(section_circumstances)
-index, stored_chunks = create_vector_store(section_embeddings, cache_dir)
+    # extract pages, chunk subsections, then store in cache
+    pages_circumstances = extract_pages(reader, page_min, page_max)
+    section_circumstances = chunk_by_subsections_with_codes(pages_circumstances)
+    section_embeddings = encode_chunks(section_circumstances)
+    index, stored_chunks = create_vector_store(section_embeddings, cache_dir)
+
+    # precompute the top rules per variable for the "cached" retrieval mode
+    build_variable_rule_cache(index, stored_chunks, cache_dir)
+
+
+if __name__ == "__main__":
+    with profile(f"{cache_dir}profile_index_rules"):
+        main()
+    write_report(f"{cache_dir}timing_index_rules.json")
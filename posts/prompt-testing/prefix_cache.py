@@ -0,0 +1,171 @@
+"""Estimate OpenAI prompt-cache hits for generated batch files
+
+Requests are streamed in file order and their tokenized messages inserted
+into a prefix trie. The prefix a request shares with any earlier request is
+what the API could serve from cache: nothing under 1024 tokens, then in
+128-token steps. Requests are grouped into layouts by file and by the prompt
+version at the end of their custom_id (e.g. "<uid>_2"), so layouts can be
+compared for cache efficiency before anything is submitted.
+
+    python prefix_cache.py json/output_2025-01-01.jsonl [more files...]
+"""
+
+import argparse
+import json
+import os
+from collections import defaultdict
+
+import numpy as np
+
+from src.token_budget import get_encoding
+
+CACHE_MIN_TOKENS = 1024
+CACHE_INCREMENT = 128
+
+# role and end-of-message markers, negative so they never collide with tokens
+ROLE_MARKERS = {"system": -1, "user": -2, "assistant": -3, "developer": -4}
+END_MARKER = -9
+
+
+class _Node:
+    __slots__ = ("edge", "children")
+
+    def __init__(self, edge):
+        self.edge = edge
+        self.children = {}
+
+
+class PrefixTrie:
+    """Radix trie over token sequences. Runs of tokens without branches are
+    stored on a single edge, so long shared prefixes cost one node."""
+
+    def __init__(self):
+        self.root = _Node(())
+
+    def insert(self, tokens):
+        "Insert a sequence, returning the prefix length it shares with earlier ones"
+        tokens = tuple(tokens)
+        node = self.root
+        i = 0
+
+        while i < len(tokens):
+            child = node.children.get(tokens[i])
+            if child is None:
+                node.children[tokens[i]] = _Node(tokens[i:])
+                return i
+
+            edge = child.edge
+            k = 1
+            limit = min(len(edge), len(tokens) - i)
+            while k < limit and edge[k] == tokens[i + k]:
+                k += 1
+
+            if k == len(edge):
+                node = child
+                i += k
+                continue
+
+            # diverges inside the edge, split it
+            mid = _Node(edge[:k])
+            child.edge = edge[k:]
+            mid.children[edge[k]] = child
+            node.children[tokens[i]] = mid
+            i += k
+            if i < len(tokens):
+                mid.children[tokens[i]] = _Node(tokens[i:])
+            return i
+
+        return len(tokens)
+
+
+def message_tokens(messages, model):
+    "Flatten a chat message list into one token sequence"
+    encoding = get_encoding(model)
+    tokens = []
+    for message in messages:
+        tokens.append(ROLE_MARKERS.get(message["role"], -5))
+        tokens.extend(encoding.encode(message["content"]))
+        tokens.append(END_MARKER)
+
+    return tokens
+
+
+def cacheable_tokens(shared, prompt_tokens):
+    "Tokens the API could serve from cache, given the shared prefix length"
+    if prompt_tokens < CACHE_MIN_TOKENS or shared < CACHE_MIN_TOKENS:
+        return 0
+    return shared // CACHE_INCREMENT * CACHE_INCREMENT
+
+
+def layout_key(path, custom_id):
+    version = custom_id.rsplit("_", 1)[-1] if "_" in custom_id else "-"
+    return f"{os.path.basename(path)}:{version}"
+
+
+def analyze(path):
+    """Stream one batch file and return {layout: {"shared": [...], "tokens": [...]}}.
+    All requests in the file share one trie, as they share one cache."""
+    trie = PrefixTrie()
+    layouts = defaultdict(lambda: {"shared": [], "tokens": []})
+
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            body = request["body"]
+            tokens = message_tokens(body["messages"], body["model"])
+
+            layout = layouts[layout_key(path, request["custom_id"])]
+            layout["shared"].append(trie.insert(tokens))
+            layout["tokens"].append(len(tokens))
+
+    return layouts
+
+
+def summarize(shared, tokens):
+    shared = np.asarray(shared)
+    tokens = np.asarray(tokens)
+    cached = np.array([cacheable_tokens(s, t) for s, t in zip(shared, tokens)])
+
+    return {
+        "requests": len(tokens),
+        "mean_tokens": float(tokens.mean()),
+        "shared_p10": float(np.percentile(shared, 10)),
+        "shared_p50": float(np.percentile(shared, 50)),
+        "shared_p90": float(np.percentile(shared, 90)),
+        "shared_fraction": float(shared.sum() / tokens.sum()),
+        "hit_rate": float((cached > 0).mean()),
+        "cacheable_fraction": float(cached.sum() / tokens.sum()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("batch_files", nargs="+")
+    parser.add_argument("--json", help="also write the summary to this path")
+    args = parser.parse_args()
+
+    report = {}
+    for path in args.batch_files:
+        for layout, values in analyze(path).items():
+            report[layout] = summarize(values["shared"], values["tokens"])
+
+    print(
+        f"{'layout':<36}{'n':>6}{'tokens':>8}{'p10':>7}{'p50':>7}{'p90':>7}"
+        f"{'shared':>8}{'hits':>7}{'cached':>8}"
+    )
+    for layout, s in report.items():
+        print(
+            f"{layout:<36}{s['requests']:>6}{s['mean_tokens']:>8.0f}"
+            f"{s['shared_p10']:>7.0f}{s['shared_p50']:>7.0f}{s['shared_p90']:>7.0f}"
+            f"{s['shared_fraction']:>8.1%}{s['hit_rate']:>7.1%}{s['cacheable_fraction']:>8.1%}"
+        )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Compare the per-variable rule cache against per-narrative dense search
+
+For every narrative and matched variable, the rule sections returned by the
+"cached" mode are compared with those from the current "dense" search. High
+overlap means embedding can be switched off at prompt time.
+"""
+
+import argparse
+import time
+from collections import defaultdict
+
+from src.rag import search_vector_database
+
+VECTOR_INDEX = "cache/rules_index.faiss"
+VECTOR_DATABASE = "cache/rule_chunks.pkl"
+NUMBER_MATCHES = 2
+
+
+def sections_by_variable(rules_list):
+    sections = defaultdict(set)
+    for rule in rules_list:
+        sections[rule["variable"]].add(rule["section_number"])
+    return sections
+
+
+def main():
+    import pandas as pd
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--narratives", default="data/train_narratives_sample_200.csv")
+    parser.add_argument("--threshold", type=float, default=0.8)
+    args = parser.parse_args()
+
+    narratives = pd.read_csv(args.narratives)
+    texts = (narratives["NarrativeLE"] + " " + narratives["NarrativeCME"]).tolist()
+
+    timings = {"dense": 0.0, "cached": 0.0}
+    overlap = defaultdict(list)
+
+    # warm up so model and index loading are not counted
+    for mode in timings:
+        search_vector_database(
+            texts[0], NUMBER_MATCHES, VECTOR_INDEX, VECTOR_DATABASE, retrieval=mode
+        )
+
+    for text in texts:
+        results = {}
+        for mode in timings:
+            start = time.perf_counter()
+            rules_list, _ = search_vector_database(
+                text, NUMBER_MATCHES, VECTOR_INDEX, VECTOR_DATABASE, retrieval=mode
+            )
+            timings[mode] += time.perf_counter() - start
+            results[mode] = sections_by_variable(rules_list)
+
+        # jaccard overlap of rule sections, per matched variable
+        for variable, dense_sections in results["dense"].items():
+            cached_sections = results["cached"].get(variable, set())
+            union = dense_sections | cached_sections
+            overlap[variable].append(len(dense_sections & cached_sections) / len(union))
+
+    print(f"{'variable':<32}{'n':>6}{'overlap':>9}")
+    all_scores = []
+    for variable, scores in sorted(overlap.items()):
+        all_scores.extend(scores)
+        print(f"{variable:<32}{len(scores):>6}{sum(scores) / len(scores):>9.3f}")
+
+    mean_overlap = sum(all_scores) / max(1, len(all_scores))
+    print(f"\nmean overlap: {mean_overlap:.3f}")
+    for mode, total in timings.items():
+        print(f"{mode:<7} {1000 * total / len(texts):8.2f} ms per narrative")
+
+    if mean_overlap >= args.threshold:
+        print(f"overlap >= {args.threshold}: retrieval='cached' is a safe default")
+    else:
+        print(f"overlap < {args.threshold}: keep per-query search")
+
+
+if __name__ == "__main__":
+    main()
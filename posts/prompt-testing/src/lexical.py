@@ -0,0 +1,82 @@
+"Lexical (BM25) retrieval over NVDRS rule chunks, and rank fusion with dense search"
+
+import math
+import re
+from collections import Counter, defaultdict
+
+# section numbers (e.g. 4.2.1) are kept whole, everything else is split on
+# non-word characters
+TOKEN_PATTERN = re.compile(r"\d+\.\d+\.\d+|[a-z0-9_]+")
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def chunk_variable_code(chunk):
+    "Variable code from a chunk header like '4.2.1 Depressed mood: DepressedMood'"
+    title = chunk.get("section_title", "")
+    if ":" not in title:
+        return None
+    return title.rsplit(":", 1)[1].strip() or None
+
+
+class BM25Index:
+    """Inverted index over rule chunks scored with BM25.
+
+    Section numbers and variable codes in the chunk header are indexed as
+    their own terms and repeated `header_boost` times, so a query naming a
+    variable code or section lands on that chunk.
+    """
+
+    def __init__(self, chunks, k1=1.5, b=0.75, header_boost=3):
+        self.k1 = k1
+        self.b = b
+        self.codes = [chunk_variable_code(c) for c in chunks]
+        self.postings = defaultdict(list)
+        self.doc_len = []
+
+        for doc_id, chunk in enumerate(chunks):
+            terms = tokenize(chunk["text"])
+            terms += tokenize(chunk.get("section_title", "")) * header_boost
+            self.doc_len.append(len(terms))
+
+            for term, tf in Counter(terms).items():
+                self.postings[term].append((doc_id, tf))
+
+        self.n_docs = len(chunks)
+        self.avg_len = sum(self.doc_len) / max(1, self.n_docs)
+        self.idf = {
+            term: math.log(1 + (self.n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in self.postings.items()
+        }
+
+    def search(self, query, top_k=5):
+        "Return [(chunk index, score)] for the best `top_k` chunks"
+        scores = defaultdict(float)
+
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for doc_id, tf in self.postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_len[doc_id] / self.avg_len)
+                scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+
+        ranked = sorted(scores.items(), key=lambda x: x[1], reverse=True)
+        return ranked[:top_k]
+
+    def chunks_for_code(self, variable):
+        "Indices of chunks whose header carries this variable code"
+        return [i for i, code in enumerate(self.codes) if code == variable]
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Fuse several ranked lists of chunk indices into one list of
+    (index, score), where score = sum of 1 / (k + rank) over the lists"""
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, idx in enumerate(ranking):
+            scores[idx] += 1.0 / (k + rank + 1)
+
+    return sorted(scores.items(), key=lambda x: x[1], reverse=True)
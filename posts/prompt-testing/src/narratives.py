@@ -0,0 +1,145 @@
+"""Narrative preprocessing to cut prompt tokens
+
+The law enforcement (LE) and coroner/medical examiner (CME) narratives often
+repeat the same sentences. `merge_narratives` keeps the LE text and adds only
+the CME sentences that are not near-duplicates of something already kept
+(MinHash over word shingles). `prepare_narratives` then collapses identical
+merged narratives across the dataset, so each is sent once and its result is
+fanned out to the duplicate uids with `fan_out`.
+"""
+
+import hashlib
+import random
+import re
+
+from .token_budget import token_length
+
+SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9\"'(])")
+WORD = re.compile(r"[a-z0-9]+")
+
+NUM_PERM = 64
+SHINGLE_SIZE = 3
+_PRIME = (1 << 61) - 1
+_rng = random.Random(0)
+_PERMUTATIONS = [
+    (_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)
+]
+
+
+def normalize_whitespace(text):
+    if not isinstance(text, str):
+        return ""
+    return " ".join(text.split())
+
+
+def split_sentences(text):
+    text = normalize_whitespace(text)
+    return [s for s in SENTENCE_SPLIT.split(text) if s] if text else []
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def sentence_signature(sentence):
+    "MinHash signature over the word shingles of a sentence"
+    words = WORD.findall(sentence.lower())
+    shingles = {
+        " ".join(words[i : i + SHINGLE_SIZE])
+        for i in range(max(1, len(words) - SHINGLE_SIZE + 1))
+    }
+    hashes = [_hash(s) for s in shingles]
+
+    return tuple(min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMUTATIONS)
+
+
+def similarity(sig_a, sig_b):
+    "Estimated Jaccard similarity of two signatures"
+    return sum(a == b for a, b in zip(sig_a, sig_b)) / NUM_PERM
+
+
+def merge_narratives(*texts, threshold=0.8):
+    """Join narratives, dropping sentences that exactly or nearly repeat a
+    sentence already kept. Narratives are separated by a blank line."""
+    seen_exact = set()
+    kept_signatures = []
+    parts = []
+
+    for text in texts:
+        kept = []
+        for sentence in split_sentences(text):
+            key = " ".join(WORD.findall(sentence.lower()))
+            if key in seen_exact:
+                continue
+
+            signature = sentence_signature(sentence)
+            if any(similarity(signature, s) >= threshold for s in kept_signatures):
+                continue
+
+            seen_exact.add(key)
+            kept_signatures.append(signature)
+            kept.append(sentence)
+
+        if kept:
+            parts.append(" ".join(kept))
+
+    return "\n\n".join(parts)
+
+
+def prepare_narratives(
+    narratives, fields=("NarrativeLE", "NarrativeCME"), threshold=0.8, merge=True
+):
+    """Merge the narrative fields of each row and collapse identical results.
+    With `merge=False` the fields are sent unchanged (joined by a blank line
+    if there are several) and only rows with identical text are collapsed.
+
+    Returns (unique, duplicates): `unique` is a list of (uid, text) to send,
+    and `duplicates` maps a sent uid to the other uids sharing its text.
+    """
+    first_uid = {}
+    unique = []
+    duplicates = {}
+
+    for row in narratives.itertuples(index=False):
+        uid = getattr(row, "uid")
+        values = [getattr(row, f) for f in fields]
+        if merge:
+            text = merge_narratives(*values, threshold=threshold)
+        elif len(values) == 1:
+            text = values[0]
+        else:
+            text = "\n\n".join(str(v) for v in values)
+
+        if text in first_uid:
+            duplicates.setdefault(str(first_uid[text]), []).append(str(uid))
+            continue
+
+        first_uid[text] = uid
+        unique.append((uid, text))
+
+    return unique, duplicates
+
+
+def fan_out(result_lines, duplicates):
+    """Copy each result line to the duplicate uids of its narrative. Custom
+    ids look like "<uid>_<version>"."""
+    output = list(result_lines)
+    for line in result_lines:
+        uid, _, version = line["custom_id"].rpartition("_")
+        for other in duplicates.get(uid, []):
+            output.append({**line, "custom_id": f"{other}_{version}"})
+
+    return output
+
+
+def token_savings(raw_texts, unique, model="gpt-4o-mini"):
+    "Narrative tokens before and after preprocessing"
+    before = sum(token_length(text, model) for text in raw_texts)
+    after = sum(token_length(text, model) for _, text in unique)
+    return {
+        "narratives": len(raw_texts),
+        "sent": len(unique),
+        "tokens_before": before,
+        "tokens_after": after,
+        "tokens_saved": before - after,
+    }
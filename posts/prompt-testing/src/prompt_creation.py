@@ -1,5 +1,6 @@
 from itertools import product
-from src.rag import create_prompt_rules, search_vector_database
+from src.rag import cached_prompt_rules, create_prompt_rules, search_vector_database
+from src.timing import count, span
 
 
 class Prompt:
@@ -46,21 +47,34 @@ class Prompt:
         example_output: str | list = None,
         footer: str | list = None,
         include_rag: bool | list = False,
+        retrieval: str = "dense",
+        rules_token_budget: int = None,
         **kwargs
     ) -> list:
         """Create multiple standard prompts based on all combinations of list elements.
         This puts the narrative at the end to support OpenAI prompt caching.
+        `retrieval` selects the rules search ("dense", "lexical", "hybrid" or
+        "cached"). "cached" uses the precomputed per-variable rules without
+        evidence snippets, so the rules block is memoized per variable set.
+        `rules_token_budget` caps the tokens spent on rules in every mode.
         """
 
         # Ensure all inputs are lists for consistent iteration
-        if include_rag:
-            val, matched_variables = search_vector_database(
-                narrative,
-                2,
-                "cache/rules_index.faiss",
-                "cache/rule_chunks.pkl",
+        if include_rag and retrieval == "cached":
+            rag = cached_prompt_rules(
+                narrative, "cache/variable_rules.pkl", 2, rules_token_budget
             )
-            rag = create_prompt_rules(val, matched_variables)
+            params = [body, example_output, rag, footer, header, narrative]
+        elif include_rag:
+            with span("prompt.rules_search"):
+                val, matched_variables = search_vector_database(
+                    narrative,
+                    2,
+                    "cache/rules_index.faiss",
+                    "cache/rule_chunks.pkl",
+                    retrieval=retrieval,
+                )
+            rag = create_prompt_rules(val, matched_variables, rules_token_budget)
             params = [body, example_output, rag, footer, header, narrative]
         else:
             params = [body, example_output, footer, header, narrative]
@@ -69,10 +83,12 @@ class Prompt:
         ]
 
         # unpack params, then pass to concat
-        prompt_combinations = product(*param_lists)
-        prompts = [
-            self.prompt_concat(combination) for combination in prompt_combinations
-        ]
+        with span("prompt.assemble"):
+            prompt_combinations = product(*param_lists)
+            prompts = [
+                self.prompt_concat(combination) for combination in prompt_combinations
+            ]
+        count("prompt.prompts", len(prompts))
 
         return prompts
 
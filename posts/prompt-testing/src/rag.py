@@ -1,17 +1,46 @@
 "Functions for RAG embedding, indexing"
 
-import faiss
+import os
 import pickle
 import re
+from functools import lru_cache
+
 import numpy as np
-from sentence_transformers import SentenceTransformer
 from .keyterms import keyterms
+from .lexical import BM25Index, reciprocal_rank_fusion
+from .timing import count, span, timed
+from .token_budget import trim_to_budget
 
 # embedding model
 MODEL = "all-mpnet-base-v2"
 
 
+# faiss and sentence_transformers pull in torch, so they are only imported
+# on first use. Models and indexes are cached for the life of the process
+@lru_cache(maxsize=None)
+@timed("rag.model_load")
+def get_model(model_name=MODEL):
+    "Load (once) the sentence transformer used for encoding"
+    from sentence_transformers import SentenceTransformer
+
+    return SentenceTransformer(model_name)
+
+
+@lru_cache(maxsize=None)
+@timed("rag.index_load")
+def load_vector_database(vector_index, vector_database):
+    "Read (once) a faiss index and its stored chunks"
+    import faiss
+
+    index = faiss.read_index(vector_index)
+    with open(vector_database, "rb") as file:
+        chunks = pickle.load(file)
+
+    return index, chunks
+
+
 # functions for structured text extraction
+@timed("rag.pdf_extract")
 def extract_pages(pdf_reader, page_start, page_end):
     "Extract and concatenate selected pages from a pdf"
     text = ""
@@ -23,7 +52,7 @@ def extract_pages(pdf_reader, page_start, page_end):
 
 def search_rules(query, index, chunks, top_k=5):
     # Load the model (same as used for encoding)
-    model = SentenceTransformer(MODEL)
+    model = get_model()
 
     # Encode the query
     query_embedding = model.encode([query])[0].reshape(1, -1).astype("float32")
@@ -49,6 +78,7 @@ def search_rules(query, index, chunks, top_k=5):
 ## CODE BELOW IS ABOUT 85% CLAUDE GENERATED ##
 
 
+@timed("rag.chunk")
 def chunk_by_subsections_with_codes(text):
     # Pattern that handles section numbers plus the variable code format
     pattern = r"(\d+\.\d+\.\d+\s+[\w\s]+(?::\s*[A-Za-z_/]+)?)"
@@ -78,12 +108,14 @@ def chunk_by_subsections_with_codes(text):
     return chunks
 
 
+@timed("rag.encode_chunks")
 def encode_chunks(chunks, batch_size=8):
     # Load a lightweight but effective model
-    model = SentenceTransformer(MODEL)
+    model = get_model()
 
     # Extract just the text for encoding
     texts = [chunk["text"] for chunk in chunks]
+    count("rag.chunks_encoded", len(texts))
 
     # Process in batches to manage memory
     all_embeddings = []
@@ -104,6 +136,8 @@ def encode_chunks(chunks, batch_size=8):
 
 
 def create_vector_store(encoded_chunks, output_dir=""):
+    import faiss
+
     # Extract embeddings
     embeddings = np.array([chunk["embedding"] for chunk in encoded_chunks]).astype(
         "float32"
@@ -135,7 +169,7 @@ def create_vector_store(encoded_chunks, output_dir=""):
 
 def search_rules(query, index, chunks, top_k=5):
     # Load the model (same as used for encoding)
-    model = SentenceTransformer(MODEL)
+    model = get_model()
 
     # Encode the query
     query_embedding = model.encode([query])[0].reshape(1, -1).astype("float32")
@@ -157,30 +191,40 @@ def search_rules(query, index, chunks, top_k=5):
     return results
 
 
-def search_vector_database(input_text, number_matches, vector_index, vector_database):
-    index = faiss.read_index(vector_index)
-    with open(vector_database, "rb") as file:
-        chunks = pickle.load(file)
-    model = SentenceTransformer(MODEL)
+@lru_cache(maxsize=None)
+@timed("rag.bm25_build")
+def load_lexical_index(vector_index, vector_database):
+    "Build (once) a BM25 index over the stored chunks"
+    _, chunks = load_vector_database(vector_index, vector_database)
+    return BM25Index(chunks)
 
-    # Improved approach
-    rules_list = []
-    matched_variables = {}
 
-    for variable, config in keyterms.items():
-        # Pattern matching with word boundaries and capturing context
-        # just try 30 characters on either side to avoid including too much irrelevent text
-        pattern = (
+@lru_cache(maxsize=None)
+def keyterm_patterns():
+    "Compiled keyterm regex for every variable"
+    # Pattern matching with word boundaries and capturing context
+    # just try 30 characters on either side to avoid including too much irrelevent text
+    return {
+        variable: re.compile(
             r"(.{0,30})\b("
             + "|".join(map(re.escape, config["Terms"]))
-            + r")\b(.{0,30})"
+            + r")\b(.{0,30})",
+            re.IGNORECASE,
         )
+        for variable, config in keyterms.items()
+    }
+
+
+@timed("rag.keyterm_match")
+def match_keyterms(input_text):
+    "Variables whose keyterms appear in the text, with the matched context"
+    matched_variables = {}
 
+    for variable, pattern in keyterm_patterns().items():
         # Find all matches
-        all_matches = re.finditer(pattern, input_text, re.IGNORECASE)
         variable_evidence = []
 
-        for match in all_matches:
+        for match in pattern.finditer(input_text):
             full_match = match.group(0).strip()
             matched_term = match.group(2)  # term that matched
             variable_evidence.append(
@@ -193,42 +237,106 @@ def search_vector_database(input_text, number_matches, vector_index, vector_data
                 "evidence": variable_evidence,
             }
 
-            # Use the best context for vector search
-            # Append a heading to give better context to the section header
-            best_context = variable_evidence[0]["context"]
-            query_text = f"{config['Query']}: {best_context}"
-            query_embedding = model.encode(query_text)
+    return matched_variables
+
+
+def dense_search(query_text, index, number_matches):
+    "Ranked [(chunk index, score)] from the faiss index"
+    model = get_model()
+    with span("rag.encode"):
+        query_embedding = model.encode(query_text)
+
+    # Add vector normalization for better results
+    normalized_query = query_embedding / np.linalg.norm(query_embedding)
+    with span("rag.faiss_search"):
+        distances, indices = index.search(normalized_query.reshape(1, -1), number_matches)
+
+    # deduplicate, converting distance to a similarity score
+    ranked = {}
+    for idx, dist in zip(indices[0], distances[0]):
+        if idx >= 0 and idx not in ranked:
+            ranked[int(idx)] = 1.0 / (1.0 + dist)
+
+    return list(ranked.items())
 
-            # Add vector normalization for better results
-            normalized_query = query_embedding / np.linalg.norm(query_embedding)
-            distances, indices = index.search(
-                normalized_query.reshape(1, -1), number_matches
-            )
 
-            # Track relevance scores and deduplicate
-            seen_chunks = set()
-            variable_rules = []
-
-            for i, idx_array in enumerate(indices):
-                for j, idx in enumerate(idx_array):
-                    if idx not in seen_chunks:
-                        seen_chunks.add(idx)
-                        score = 1.0 / (1.0 + distances[i][j])
-
-                        # Include metadata with the chunk
-                        chunk_with_metadata = {
-                            "text": chunks[idx]["text"],
-                            "section_number": chunks[idx].get(
-                                "section_number", "Unknown"
-                            ),
-                            "relevance_score": score,
-                            "variable": variable,
-                        }
-                        variable_rules.append(chunk_with_metadata)
-
-            # Sort by relevance and append
-            variable_rules.sort(key=lambda x: x["relevance_score"], reverse=True)
-            rules_list.extend(variable_rules)
+def search_vector_database(
+    input_text, number_matches, vector_index, vector_database, retrieval="dense"
+):
+    """Find coding rules for every variable whose keyterms appear in the text.
+
+    `retrieval` is "dense" (faiss search only), "lexical" (BM25 only),
+    "hybrid" or "cached". In hybrid mode a variable whose code heads a rule
+    section is answered from the lexical index alone; otherwise BM25 and
+    dense results are merged with reciprocal rank fusion. "cached" looks up
+    the rules precomputed per variable by `build_variable_rule_cache`, with
+    no embedding or search at prompt time.
+    """
+    if retrieval not in ("dense", "lexical", "hybrid", "cached"):
+        raise ValueError(f"Unknown retrieval mode: {retrieval}")
+
+    if retrieval != "cached":
+        index, chunks = load_vector_database(vector_index, vector_database)
+    if retrieval in ("lexical", "hybrid"):
+        lexical = load_lexical_index(vector_index, vector_database)
+
+    # Improved approach
+    rules_list = []
+    matched_variables = match_keyterms(input_text)
+    count("rag.variables_matched", len(matched_variables))
+
+    if retrieval == "cached":
+        rule_cache = load_variable_rule_cache(variable_cache_path(vector_database))
+        for variable in matched_variables:
+            rules_list.extend(rule_cache.get(variable, [])[:number_matches])
+
+        rules_list.sort(key=lambda x: x["relevance_score"], reverse=True)
+        return rules_list, matched_variables
+
+    for variable, match in matched_variables.items():
+        config = keyterms[variable]
+
+        # Use the best context for the search
+        # Append a heading to give better context to the section header
+        best_context = match["evidence"][0]["context"]
+        query_text = f"{config['Query']}: {best_context}"
+
+        if retrieval == "dense":
+            ranked = dense_search(query_text, index, number_matches)
+        else:
+            with span("rag.bm25_search"):
+                lexical_ranked = lexical.search(
+                    f"{variable} {query_text}", number_matches
+                )
+            code_hits = lexical.chunks_for_code(variable)
+
+            if retrieval == "lexical" or code_hits:
+                # exact variable-code sections first, then BM25 order
+                ranking = code_hits + [i for i, _ in lexical_ranked]
+            else:
+                dense_ranked = dense_search(query_text, index, number_matches)
+                ranking = [i for i, _ in reciprocal_rank_fusion(
+                    [[i for i, _ in dense_ranked], [i for i, _ in lexical_ranked]]
+                )]
+
+            # deduplicate, score by fused rank
+            ranking = list(dict.fromkeys(ranking))[:number_matches]
+            ranked = [(idx, 1.0 / (1.0 + rank)) for rank, idx in enumerate(ranking)]
+
+        # Include metadata with the chunk
+        variable_rules = [
+            {
+                "text": chunks[idx]["text"],
+                "section_number": chunks[idx].get("section_number", "Unknown"),
+                "relevance_score": score,
+                "variable": variable,
+            }
+            for idx, score in ranked
+        ]
+
+        # Sort by relevance and append
+        variable_rules.sort(key=lambda x: x["relevance_score"], reverse=True)
+        rules_list.extend(variable_rules)
 
     # Final sorting of all rules by relevance
     rules_list.sort(key=lambda x: x["relevance_score"], reverse=True)
@@ -236,7 +344,64 @@ def search_vector_database(input_text, number_matches, vector_index, vector_data
     return rules_list, matched_variables
 
 
-def create_prompt_rules(rules_list, matched_variables):
+def variable_cache_path(vector_database):
+    "The per-variable rule cache lives next to the stored chunks"
+    return os.path.join(os.path.dirname(vector_database), "variable_rules.pkl")
+
+
+def build_variable_rule_cache(index, chunks, output_dir="", number_matches=5):
+    """Precompute the top rule chunks for every variable in `keyterms` from
+    its query alone, and store them for the "cached" retrieval mode"""
+    rule_cache = {}
+
+    for variable, config in keyterms.items():
+        rule_cache[variable] = [
+            {
+                "text": chunks[idx]["text"],
+                "section_number": chunks[idx].get("section_number", "Unknown"),
+                "relevance_score": score,
+                "variable": variable,
+            }
+            for idx, score in dense_search(config["Query"], index, number_matches)
+        ]
+
+    with open(f"{output_dir}variable_rules.pkl", "wb") as f:
+        pickle.dump(rule_cache, f)
+
+    return rule_cache
+
+
+@lru_cache(maxsize=None)
+def load_variable_rule_cache(path):
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+@lru_cache(maxsize=1024)
+def _cached_rules_prompt(variables, rule_cache_path, number_matches, max_tokens):
+    rule_cache = load_variable_rule_cache(rule_cache_path)
+    rules_list = [
+        rule
+        for variable in variables
+        for rule in rule_cache.get(variable, [])[:number_matches]
+    ]
+    return create_prompt_rules(rules_list, {}, max_tokens)
+
+
+@timed("rag.cached_rules")
+def cached_prompt_rules(input_text, rule_cache_path, number_matches=2, max_tokens=None):
+    """Rules prompt from the per-variable cache. Evidence snippets are left
+    out, so the output depends only on which variables matched and is
+    memoized per combination. `max_tokens` is applied as in
+    `create_prompt_rules`"""
+    variables = tuple(match_keyterms(input_text))
+    return _cached_rules_prompt(variables, rule_cache_path, number_matches, max_tokens)
+
+
+@timed("rag.format_rules")
+def create_prompt_rules(rules_list, matched_variables, max_tokens=None):
+    """Format matched rules for the prompt. With `max_tokens`, the least
+    relevant rules are dropped until the rule texts fit the budget."""
     PROMPT_RULES = """
 If present, use the following rules to guide your coding of variables. Closely follow these instructions:
     - Apply ONLY the rules relevant to the question
@@ -255,6 +420,22 @@ If present, use the following rules to guide your coding of variables. Closely f
                 rules_by_variable[variable] = []
             rules_by_variable[variable].append(rule)
 
+        # Limit to top 2 rules per variable, then to the token budget
+        rules_by_variable = {v: r[:2] for v, r in rules_by_variable.items()}
+        if max_tokens is not None:
+            selected = [r for rules in rules_by_variable.values() for r in rules]
+            kept = trim_to_budget(
+                [r["text"] for r in selected],
+                [r["relevance_score"] for r in selected],
+                max_tokens,
+            )
+            kept_ids = {id(selected[i]) for i in kept}
+            rules_by_variable = {
+                v: [r for r in rules if id(r) in kept_ids]
+                for v, rules in rules_by_variable.items()
+            }
+            rules_by_variable = {v: r for v, r in rules_by_variable.items() if r}
+
         # Add rules organized by variable
         for variable, variable_rules in rules_by_variable.items():
             PROMPT_RULES += f"\n\n## RULES FOR {variable}:\n"
@@ -266,9 +447,7 @@ If present, use the following rules to guide your coding of variables. Closely f
                 PROMPT_RULES += f"Evidence found: {evidence_text}\n\n"
 
             # Add the actual rules, with section numbers
-            for i, rule in enumerate(
-                variable_rules[:2]
-            ):  # Limit to top 2 rules per variable
+            for i, rule in enumerate(variable_rules):
                 section_info = f"Section {rule.get('section_number', 'Unknown')}"
                 PROMPT_RULES += f"RULE {i+1} [{section_info}]:\n{rule['text']}\n\n"
 
@@ -0,0 +1,114 @@
+"""Local response cache for OpenAI batch requests
+
+Completions are stored in SQLite keyed by a hash of the request body (model,
+messages and params), so byte-identical requests are never submitted twice.
+Cached hits are written out in the same line format as the batch output
+file, so collecting a run is just merging the two.
+
+Kept identical in uv-testing and prompt-testing/src, checked by
+posts/check_shared_modules.py.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+
+
+def request_key(body):
+    "Stable hash of a request body"
+    canonical = json.dumps(body, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, path="cache/responses.sqlite"):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT NOT NULL)"
+        )
+
+    def get_many(self, keys):
+        "Return {key: response body} for the keys present in the cache"
+        found = {}
+        keys = list(keys)
+        # stay under sqlite's bound-parameter limit
+        for i in range(0, len(keys), 500):
+            batch = keys[i : i + 500]
+            rows = self.conn.execute(
+                f"SELECT key, response FROM responses WHERE key IN ({','.join('?' * len(batch))})",
+                batch,
+            )
+            found.update((key, json.loads(response)) for key, response in rows)
+
+        return found
+
+    def put_many(self, items):
+        "Store (key, response body) pairs"
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO responses (key, response) VALUES (?, ?)",
+                [(key, json.dumps(response)) for key, response in items],
+            )
+
+    def close(self):
+        self.conn.close()
+
+
+def _output_line(custom_id, response_body):
+    "A result line in the same shape as the OpenAI batch output file"
+    return {
+        "id": None,
+        "custom_id": custom_id,
+        "response": {"status_code": 200, "body": response_body},
+        "error": None,
+        "cached": True,
+    }
+
+
+def split_cached(json_list, cache):
+    """Split batch requests into (requests to submit, cached result lines)"""
+    keys = [request_key(entry["body"]) for entry in json_list]
+    found = cache.get_many(set(keys))
+
+    misses = []
+    hits = []
+    for entry, key in zip(json_list, keys):
+        if key in found:
+            hits.append(_output_line(entry["custom_id"], found[key]))
+        else:
+            misses.append(entry)
+
+    return misses, hits
+
+
+def read_jsonl(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def write_jsonl(entries, path):
+    with open(path, "w", encoding="utf-8") as f:
+        for entry in entries:
+            json.dump(entry, f)
+            f.write("\n")
+
+
+def collect_results(output_path, request_path, cached_path, cache):
+    """Store fresh batch results in the cache and return them merged with the
+    cached hits of the same run. Only successful responses are cached."""
+    submitted = read_jsonl(request_path) if os.path.exists(request_path) else []
+    bodies = {entry["custom_id"]: entry["body"] for entry in submitted}
+
+    fresh = read_jsonl(output_path) if output_path else []
+    cache.put_many(
+        (request_key(bodies[line["custom_id"]]), line["response"]["body"])
+        for line in fresh
+        if line.get("response") and line["response"].get("status_code") == 200
+        and line["custom_id"] in bodies
+    )
+
+    cached = read_jsonl(cached_path) if os.path.exists(cached_path) else []
+
+    return fresh + cached
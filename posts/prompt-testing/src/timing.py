@@ -0,0 +1,212 @@
+"""Stage timing and profiling for the prompt pipelines
+
+`span(name)` times a block and `count(name)` bumps a counter. Each stage
+keeps a running count, total and max plus a fixed-size random sample of
+durations for percentiles, so memory stays flat in long-running processes
+and recording is left on; set PIPELINE_TIMING=0 to skip it.
+
+Spans opened inside another span are recorded under "outer/inner", and each
+stage reports `self_s` (its time minus nested spans) next to `total_s`, so
+summing `self_s` never double counts.
+
+`profile(path)` wraps a run in cProfile or pyinstrument when PIPELINE_PROFILE
+is "cprofile" or "pyinstrument". `write_report(path)` dumps the summary as
+JSON.
+
+Kept identical in uv-testing and prompt-testing/src, checked by
+posts/check_shared_modules.py.
+"""
+
+import json
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+
+ENABLED = os.environ.get("PIPELINE_TIMING", "1") != "0"
+PROFILER = os.environ.get("PIPELINE_PROFILE", "").lower()
+
+# durations kept per stage for percentiles
+SAMPLE_SIZE = 1024
+
+
+class _Stage:
+    __slots__ = ("calls", "total", "self_total", "max", "sample")
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.self_total = 0.0
+        self.max = 0.0
+        self.sample = []
+
+    def add(self, duration, self_time):
+        self.calls += 1
+        self.total += duration
+        self.self_total += self_time
+        self.max = max(self.max, duration)
+
+        # reservoir sample, uniform over every call so far
+        if len(self.sample) < SAMPLE_SIZE:
+            self.sample.append(duration)
+        else:
+            slot = _rng.randrange(self.calls)
+            if slot < SAMPLE_SIZE:
+                self.sample[slot] = duration
+
+
+_rng = random.Random(0)
+_stages = defaultdict(_Stage)
+_counters = defaultdict(int)
+_local = threading.local()
+
+
+class _Span:
+    __slots__ = ("name", "key", "start", "child_time")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        if not ENABLED:
+            return self
+
+        stack = getattr(_local, "stack", None)
+        if stack is None:
+            stack = _local.stack = []
+        self.key = f"{stack[-1].key}/{self.name}" if stack else self.name
+        self.child_time = 0.0
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if not ENABLED:
+            return
+
+        duration = time.perf_counter() - self.start
+        stack = _local.stack
+        stack.pop()
+        if stack:
+            stack[-1].child_time += duration
+        _stages[self.key].add(duration, duration - self.child_time)
+
+
+def span(name):
+    "Context manager recording the wall time of a block under `name`"
+    return _Span(name)
+
+
+def timed(name):
+    "Decorator recording every call of a function under `name`"
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with _Span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def count(name, n=1):
+    if ENABLED:
+        _counters[name] += n
+
+
+def reset():
+    _stages.clear()
+    _counters.clear()
+
+
+def _percentile(values, q):
+    "Linear-interpolated percentile of an already sorted list"
+    pos = (len(values) - 1) * q / 100
+    low = int(pos)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (pos - low)
+
+
+def summary():
+    """Per-stage calls, total and self time (s), and percentiles (ms) from
+    the sampled durations, plus counters. Nested stages are keyed
+    "outer/inner" and sorted so they follow their parent"""
+    stages = {}
+    for key in sorted(_stages):
+        stage = _stages[key]
+        values = sorted(stage.sample)
+        stages[key] = {
+            "calls": stage.calls,
+            "total_s": stage.total,
+            "self_s": stage.self_total,
+            "mean_ms": 1000 * stage.total / stage.calls,
+            "p50_ms": 1000 * _percentile(values, 50),
+            "p90_ms": 1000 * _percentile(values, 90),
+            "p99_ms": 1000 * _percentile(values, 99),
+            "max_ms": 1000 * stage.max,
+        }
+
+    return {"stages": stages, "counters": dict(_counters)}
+
+
+def write_report(path):
+    "Write the summary as JSON and print the stage tree"
+    report = summary()
+    if not report["stages"] and not report["counters"]:
+        return report
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"{'stage':<36}{'calls':>8}{'total s':>10}{'self s':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for key, stage in report["stages"].items():
+        depth = key.count("/")
+        name = "  " * depth + key.rsplit("/", 1)[-1]
+        print(
+            f"{name:<36}{stage['calls']:>8}{stage['total_s']:>10.3f}{stage['self_s']:>10.3f}"
+            f"{stage['p50_ms']:>10.2f}{stage['p99_ms']:>10.2f}"
+        )
+    print(f"timing report written to {path}")
+
+    return report
+
+
+@contextmanager
+def profile(path):
+    """Profile the block with the profiler named in PIPELINE_PROFILE, writing
+    `path`.prof (cProfile) or `path`.html (pyinstrument). No-op otherwise."""
+    if PROFILER not in ("cprofile", "pyinstrument"):
+        yield
+        return
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    if PROFILER == "cprofile":
+        import cProfile
+        import pstats
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(f"{path}.prof")
+            pstats.Stats(profiler).sort_stats("cumulative").print_stats(20)
+    else:
+        from pyinstrument import Profiler
+
+        profiler = Profiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            with open(f"{path}.html", "w") as f:
+                f.write(profiler.output_html())
@@ -1,25 +1,25 @@
 """Code to submit batch output to OpenAI API"""
 
 import re
-import pandas as pd
 import json
 import numpy as np
-from nltk.corpus import stopwords
-from nltk.tokenize import word_tokenize
-from sentence_transformers import SentenceTransformer, util
-from openai import OpenAI
 from datetime import datetime
+from functools import lru_cache
 
+from product_index import load_product_index
+from response_cache import ResponseCache, split_cached, write_jsonl
+from timing import count, profile, span, timed, write_report
+from token_budget import check_batch, format_estimate, trim_to_budget
 
-# setup openai creds
-client = OpenAI()
+# heavy dependencies (pandas, nltk, sentence_transformers, openai) are
+# imported on first use, so importing this module is cheap
 
 neiss_data = r"C:\Users\gioc4\Documents\blog\data\neiss2024.csv"
 neiss_codes = r"C:\Users\gioc4\Documents\blog\data\us-national-electronic-injury-surveillance-system-neiss-product-codes.json"
 
 RUN_DATE = datetime.now().strftime("%Y-%m-%d")
 NUM_NARRATIVES = 500
-RAG_MODEL = SentenceTransformer("all-mpnet-base-v2")
+RAG_MODEL_NAME = "all-mpnet-base-v2"
 MODEL = "gpt-4o-mini"
 ROLE = """You are an expert medical grader. Your goal is to read incident narratives and 
 extract structured output based on the information available in the narrative field. Your
@@ -32,17 +32,36 @@ EXACT product name and produce code in your answer.
 # define regex to extract the core narrative for RAG
 # max number of products per-phrase
 # minimum matching score (cosine sim)
-CORE_NARRATIVE_REGEX = re.compile("\d{1,3}\s?[A-Z]{2,4}[,]?\s+(.*?)(?=\s*DX:)")
+CORE_NARRATIVE_REGEX = re.compile(r"\d{1,3}\s?[A-Z]{2,4}[,]?\s+(.*?)(?=\s*DX:)")
 RAG_MAX_PRODUCTS = 10
 RAG_MIN_MATCH = 0.35
 
+# token budget for the product list in each prompt (None = no limit), and
+# limits checked on the batch file before upload
+PRODUCT_TOKEN_BUDGET = None
+BATCH_MAX_INPUT_TOKENS = None
+BATCH_MAX_COST_USD = None
+
+# csv from modern-bert/distill_products.py predict (None = send every row).
+# Rows the local classifier is confident on are not sent to the API
+LOCAL_PREDICTIONS = None
+
+
+@lru_cache(maxsize=None)
+@timed("prepare.model_load")
+def get_rag_model():
+    from sentence_transformers import SentenceTransformer
+
+    return SentenceTransformer(RAG_MODEL_NAME)
+
+
 # stopwords for parsing phrases
-STOPWORDS = set(stopwords.words("english"))
+@lru_cache(maxsize=None)
+def get_stopwords():
+    from nltk.corpus import stopwords
+
+    return frozenset(stopwords.words("english"))
 
-def load_product_codes(path_to_file):
-    with open(path_to_file, "r", encoding="utf-8") as f:
-        data = json.load(f)
-    return data
 
 def extract_core_narrative(neiss_narrative):
     match = CORE_NARRATIVE_REGEX.search(neiss_narrative)
@@ -53,7 +72,10 @@ def extract_core_narrative(neiss_narrative):
         return neiss_narrative
 
 
+@timed("prepare.load_data")
 def load_neiss_data(path_to_file, max=5):
+    import pandas as pd
+
     dataframe = pd.read_csv(path_to_file)
     json_output = dataframe[:max].to_json(lines=True, orient="records")
     return [line for line in json_output.strip().split("\n") if line]
@@ -70,10 +92,14 @@ def get_id(json_str):
 
 # RAG STUFF HERE
 # MOSTLY CHAT-GPT GENERATED WITH SOME HUMAN EDITS
+@timed("prepare.phrase_extract")
 def extract_phrases(text, max_n=3):
+    from nltk.tokenize import word_tokenize
+
+    stopwords = get_stopwords()
     text = text.lower()
     text = re.sub(r"[^a-z0-9\s]", "", text)
-    tokens = [t for t in word_tokenize(text) if t not in STOPWORDS]
+    tokens = [t for t in word_tokenize(text) if t not in stopwords]
 
     phrases = set()
     for n in range(1, max_n + 1):
@@ -86,37 +112,60 @@ def extract_phrases(text, max_n=3):
 
 def match_phrases_to_products(phrases, embeddings, products):
     if not phrases:
-        return ["9999 - UNCATEGORIZED PRODUCT"]
+        return [{"term": "", "matches": ["9999 - UNCATEGORIZED PRODUCT"], "scores": [0.0]}]
 
     # Batch encode all phrases at once
-    phrase_embeddings = RAG_MODEL.encode(phrases, convert_to_tensor=True)
-    
-    # Compute cosine similarity in one go
-    similarity = util.cos_sim(phrase_embeddings, embeddings).cpu().numpy()
+    model = get_rag_model()
+    with span("prepare.encode"):
+        phrase_embeddings = model.encode(phrases, normalize_embeddings=True)
+    count("prepare.phrases_encoded", len(phrases))
+
+    # Both sides are unit length, so cosine similarity is a dot product
+    with span("prepare.similarity"):
+        similarity = phrase_embeddings @ embeddings.T
 
     results = []
     for i, scores in enumerate(similarity):
-        top_indices = np.argsort(scores)[::-1][:RAG_MAX_PRODUCTS]
+        top_indices = [
+            j for j in np.argsort(scores)[::-1][:RAG_MAX_PRODUCTS]
+            if scores[j] >= RAG_MIN_MATCH
+        ]
         matches = [
             f"{products[j]['code']} - {products[j]['product_title']}"
             for j in top_indices
-            if scores[j] >= RAG_MIN_MATCH
         ]
         if matches:
-            results.append({"term": phrases[i], "matches": matches})
+            results.append(
+                {
+                    "term": phrases[i],
+                    "matches": matches,
+                    "scores": [float(scores[j]) for j in top_indices],
+                }
+            )
 
     return results
 
 
-def extract_unique_matches_as_string(results):
-    seen = set()
-    unique_matches = []
+@timed("prepare.format_products")
+def extract_unique_matches_as_string(results, max_tokens=None):
+    # best similarity seen for each product
+    best = {}
 
     for entry in results:
-        for match in entry["matches"]:
-            if match not in seen:
-                seen.add(match)
-                unique_matches.append(match)
+        for match, score in zip(entry["matches"], entry["scores"]):
+            best[match] = max(score, best.get(match, score))
+
+    unique_matches = list(best)
+
+    # over budget, drop the least similar products first
+    if max_tokens is not None:
+        kept = trim_to_budget(
+            [m + "\n" for m in unique_matches],
+            [best[m] for m in unique_matches],
+            max_tokens,
+            MODEL,
+        )
+        unique_matches = [unique_matches[i] for i in kept]
 
     unique_matches.sort()
 
@@ -175,66 +224,157 @@ def create_prompt(neiss_incident, neiss_product_codes):
     return prompt
 
 
-# get NEISS narratives
-neiss_json = load_neiss_data(neiss_data, NUM_NARRATIVES)
-product_codes = load_product_codes(neiss_codes)
-
-# set up vector db for rag
-products = load_product_codes(neiss_codes)
-
-# Precompute product description embeddings
-product_texts = [p["product_title"] for p in products]
-product_embeddings = RAG_MODEL.encode(product_texts, convert_to_tensor=True)
-
 # func to loop, add rag to prompt
-def create_prompt_with_rag(neiss_json):
+def create_prompt_with_rag(neiss_json, product_embeddings, product_codes):
     neiss_narrative = get_narrative(neiss_json)
     neiss_product_narrative = extract_core_narrative(neiss_narrative)
     phrases = extract_phrases(neiss_product_narrative)
     codes = match_phrases_to_products(phrases, product_embeddings, product_codes)
-    code_str = extract_unique_matches_as_string(codes)
-    
-    return create_prompt(neiss_narrative, code_str)
-
-# now loop through whole process, fill up jsonl
-json_list = []
-
-for narrative in neiss_json:
-    id = get_id(narrative)
-    prompt = create_prompt_with_rag(narrative)
-
-    json_list.append(
-        {
-            "custom_id": f"{id}",
-            "method": "POST",
-            "url": "/v1/chat/completions",
-            "body": {
-                "model": MODEL,
-                "messages": [
-                    {"role": "system", "content": ROLE},
-                    {"role": "user", "content": prompt},
-                ],
-                "max_tokens": 100,
-                "temperature": 0.1,
-                "response_format": {"type": "json_object"},
-            },
+    code_str = extract_unique_matches_as_string(codes, PRODUCT_TOKEN_BUDGET)
+
+    with span("prepare.prompt_assemble"):
+        return create_prompt(neiss_narrative, code_str)
+
+
+def route_local_predictions(neiss_json, predictions_path):
+    """Split narratives into (rows to send, result lines for rows labeled
+    locally). Local results use the batch output format so process_batch.py
+    merges them with the API results."""
+    import pandas as pd
+
+    predictions = pd.read_csv(predictions_path)
+    local = predictions[predictions["route"] == "local"]
+    local = {
+        str(row.CPSC_Case_Number): row for row in local.itertuples(index=False)
+    }
+
+    to_send = []
+    local_lines = []
+    for narrative in neiss_json:
+        id = str(get_id(narrative))
+        if id not in local:
+            to_send.append(narrative)
+            continue
+
+        row = local[id]
+        content = {
+            "product": row.product,
+            "product_code": int(row.product_code),
+            "confidence": float(row.confidence),
         }
+        local_lines.append(
+            {
+                "id": None,
+                "custom_id": id,
+                "response": {
+                    "status_code": 200,
+                    "body": {
+                        "model": "local",
+                        "choices": [
+                            {"message": {"role": "assistant", "content": json.dumps(content)}}
+                        ],
+                    },
+                },
+                "error": None,
+                "local": True,
+            }
+        )
+
+    return to_send, local_lines
+
+
+def build_batch_requests(neiss_json, product_embeddings, product_codes):
+    "One chat-completions batch request per narrative"
+    json_list = []
+
+    for narrative in neiss_json:
+        id = get_id(narrative)
+        prompt = create_prompt_with_rag(narrative, product_embeddings, product_codes)
+
+        json_list.append(
+            {
+                "custom_id": f"{id}",
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": MODEL,
+                    "messages": [
+                        {"role": "system", "content": ROLE},
+                        {"role": "user", "content": prompt},
+                    ],
+                    "max_tokens": 100,
+                    "temperature": 0.1,
+                    "response_format": {"type": "json_object"},
+                },
+            }
+        )
+
+    return json_list
+
+
+def submit_batch(path, description):
+    "Upload a batch file and start a 24h chat-completions batch"
+    from openai import OpenAI
+
+    # setup openai creds
+    client = OpenAI()
+
+    with open(path, "rb") as batch_file:
+        batch_input_file = client.files.create(file=batch_file, purpose="batch")
+
+    return client.batches.create(
+        input_file_id=batch_input_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+        metadata={"description": description},
     )
 
-with open(f"json/output_{RUN_DATE}.jsonl", "w") as outfile:
-    for entry in json_list:
-        json.dump(entry, outfile)
-        outfile.write("\n")
-
-# upload batch to openai
-batch_input_file = client.files.create(
-    file=open(f"json/output_{RUN_DATE}.jsonl", "rb"), purpose="batch"
-)
-
-batch_input_file_id = batch_input_file.id
-client.batches.create(
-    input_file_id=batch_input_file_id,
-    endpoint="/v1/chat/completions",
-    completion_window="24h",
-    metadata={"description": f"Testing {NUM_NARRATIVES} NEISS narratives"},
-)
+
+def main():
+    # get NEISS narratives
+    neiss_json = load_neiss_data(neiss_data, NUM_NARRATIVES)
+
+    # load cached product embeddings, only re-embedding when the catalog
+    # or model changes
+    with span("prepare.product_index"):
+        product_embeddings, product_codes = load_product_index(
+            neiss_codes, RAG_MODEL_NAME, cache_dir="cache", model=get_rag_model()
+        )
+    product_embeddings = np.asarray(product_embeddings, dtype=np.float32)
+
+    # rows the distilled classifier is confident on are labeled locally
+    if LOCAL_PREDICTIONS:
+        neiss_json, local_lines = route_local_predictions(neiss_json, LOCAL_PREDICTIONS)
+        write_jsonl(local_lines, f"json/local_{RUN_DATE}.jsonl")
+        print(f"{len(local_lines)} labeled locally, {len(neiss_json)} left for the LLM")
+
+    # now loop through whole process, fill up jsonl
+    json_list = build_batch_requests(neiss_json, product_embeddings, product_codes)
+
+    # only submit requests without a cached response, the cached results
+    # are merged back in by process_batch.py
+    count("prepare.requests", len(json_list))
+    with span("prepare.cache_lookup"):
+        json_list, cached = split_cached(json_list, ResponseCache())
+    write_jsonl(cached, f"json/cached_{RUN_DATE}.jsonl")
+    print(f"{len(cached)} cached, {len(json_list)} to submit")
+    if not json_list:
+        return
+
+    batch_path = f"json/output_{RUN_DATE}.jsonl"
+    with span("prepare.serialize"):
+        write_jsonl(json_list, batch_path)
+
+    # catch oversized or overpriced batches before upload
+    with span("prepare.estimate"):
+        estimate = check_batch(batch_path, BATCH_MAX_INPUT_TOKENS, BATCH_MAX_COST_USD)
+    print(format_estimate(estimate))
+
+    # upload batch to openai
+    submit_batch(batch_path, f"Testing {NUM_NARRATIVES} NEISS narratives")
+
+
+if __name__ == "__main__":
+    with profile(f"json/profile_{RUN_DATE}"):
+        main()
+    write_report(f"json/timing_{RUN_DATE}.json")
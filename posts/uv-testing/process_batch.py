@@ -0,0 +1,49 @@
+"""Collect a finished OpenAI batch and merge it with cached and locally
+labeled responses"""
+
+import argparse
+import os
+from datetime import datetime
+
+from response_cache import ResponseCache, collect_results, read_jsonl, write_jsonl
+
+
+def download_batch_output(batch_id, path):
+    from openai import OpenAI
+
+    client = OpenAI()
+    batch = client.batches.retrieve(batch_id)
+    if batch.status != "completed":
+        raise RuntimeError(f"Batch {batch_id} is {batch.status}")
+
+    client.files.content(batch.output_file_id).write_to_file(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("batch_id", nargs="?", help="omit if every request was cached")
+    parser.add_argument("--run-date", default=datetime.now().strftime("%Y-%m-%d"))
+    args = parser.parse_args()
+
+    request_path = f"json/output_{args.run_date}.jsonl"
+    cached_path = f"json/cached_{args.run_date}.jsonl"
+    output_path = None
+
+    if args.batch_id:
+        output_path = f"json/results_{args.run_date}.jsonl"
+        download_batch_output(args.batch_id, output_path)
+
+    # fresh results go into the cache, then get merged with the cached hits
+    results = collect_results(output_path, request_path, cached_path, ResponseCache())
+
+    # rows labeled by the distilled classifier (LOCAL_PREDICTIONS)
+    local_path = f"json/local_{args.run_date}.jsonl"
+    if os.path.exists(local_path):
+        results += read_jsonl(local_path)
+
+    write_jsonl(results, f"json/merged_{args.run_date}.jsonl")
+    print(f"{len(results)} results written to json/merged_{args.run_date}.jsonl")
+
+
+if __name__ == "__main__":
+    main()
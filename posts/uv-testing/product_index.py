@@ -0,0 +1,82 @@
+"""Build and load a cached index of NEISS product-title embeddings
+
+Titles are embedded once and stored as normalized vectors in a .npy file
+next to a small JSON metadata file. Both are keyed by a hash of the product
+JSON and the model name, so the index is only rebuilt when either changes.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+
+def load_product_codes(path_to_file):
+    with open(path_to_file, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return data
+
+
+def catalog_key(path_to_file, model_name):
+    "Short hash of the catalog contents and the embedding model"
+    digest = hashlib.sha256()
+    with open(path_to_file, "rb") as f:
+        digest.update(f.read())
+    digest.update(model_name.encode("utf-8"))
+
+    return digest.hexdigest()[:16]
+
+
+def _index_paths(cache_dir, key):
+    base = os.path.join(cache_dir, f"products_{key}")
+    return f"{base}.npy", f"{base}.json"
+
+
+def build_product_index(path_to_file, model, model_name, cache_dir="cache", dtype="float32"):
+    "Embed every product title and write vectors + metadata to the cache"
+    products = load_product_codes(path_to_file)
+    key = catalog_key(path_to_file, model_name)
+    vec_path, meta_path = _index_paths(cache_dir, key)
+
+    titles = [p["product_title"] for p in products]
+    embeddings = model.encode(titles, normalize_embeddings=True).astype(dtype)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    np.save(vec_path, embeddings)
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "key": key,
+                "model_name": model_name,
+                "dtype": dtype,
+                "products": [
+                    {"code": p["code"], "product_title": p["product_title"]}
+                    for p in products
+                ],
+            },
+            f,
+        )
+
+    return embeddings, products
+
+
+def load_product_index(path_to_file, model_name, cache_dir="cache", model=None, dtype="float32"):
+    """Return (embeddings, products) for the catalog, memory-mapping the
+    cached vectors when present and building them otherwise. Embeddings are
+    unit length, so cosine similarity is a dot product."""
+
+    key = catalog_key(path_to_file, model_name)
+    vec_path, meta_path = _index_paths(cache_dir, key)
+
+    if os.path.exists(vec_path) and os.path.exists(meta_path):
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        return np.load(vec_path, mmap_mode="r"), meta["products"]
+
+    if model is None:
+        from sentence_transformers import SentenceTransformer
+
+        model = SentenceTransformer(model_name)
+
+    return build_product_index(path_to_file, model, model_name, cache_dir, dtype)
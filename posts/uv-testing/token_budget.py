@@ -0,0 +1,167 @@
+"""Token counting, prompt budgets and batch cost estimates
+
+Prompts are a shared prefix (role, instructions, examples, rules) followed
+by per-row text. `count_tokens` is memoized and meant for fragments that
+repeat across prompts; per-row text goes through `token_length`, which is not
+cached. `estimate_batch` splits each message at a line break inside the
+prefix it shares with a recent message, so the shared part is tokenized once
+per run and only the row-specific rest every time. Counts can be off by a
+token or two at the split, which is fine for budgeting.
+
+Kept identical in uv-testing and prompt-testing/src, checked by
+posts/check_shared_modules.py.
+"""
+
+import json
+import os
+from collections import defaultdict, deque
+from functools import lru_cache
+
+# USD per 1M tokens, standard (non-batch) pricing
+MODEL_PRICES = {
+    "gpt-4o-mini": {"input": 0.15, "output": 0.60},
+    "gpt-4o": {"input": 2.50, "output": 10.00},
+}
+BATCH_DISCOUNT = 0.5
+
+# OpenAI batch limits
+MAX_BATCH_REQUESTS = 50_000
+MAX_BATCH_FILE_MB = 200
+
+# chat format overhead per message and per reply
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model):
+    import tiktoken
+
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+def token_length(text, model="gpt-4o-mini"):
+    "Number of tokens in a text, not memoized (for per-row text)"
+    if not text:
+        return 0
+    return len(get_encoding(model).encode(text))
+
+
+@lru_cache(maxsize=4096)
+def count_tokens(text, model="gpt-4o-mini"):
+    "Number of tokens in a fragment shared across prompts, memoized"
+    return token_length(text, model)
+
+
+class PrefixTokenCounter:
+    """Count chat message tokens, tokenizing the part a message shares with
+    one of the last `n_recent` messages at the same position only once"""
+
+    def __init__(self, model="gpt-4o-mini", n_recent=8):
+        self.model = model
+        self.recent = defaultdict(lambda: deque(maxlen=n_recent))
+
+    def count(self, text, position=0):
+        recent = self.recent[position]
+        shared = max((len(os.path.commonprefix([text, r])) for r in recent), default=0)
+        recent.append(text)
+
+        # split on a line break so the prefix tokenizes the same every time
+        cut = text.rfind("\n", 0, shared) + 1
+        return count_tokens(text[:cut], self.model) + token_length(text[cut:], self.model)
+
+    def count_messages(self, messages):
+        "Input tokens for a chat-completions message list"
+        return TOKENS_PER_REPLY + sum(
+            TOKENS_PER_MESSAGE + self.count(m["content"], i)
+            for i, m in enumerate(messages)
+        )
+
+
+def trim_to_budget(fragments, scores, budget, model="gpt-4o-mini"):
+    """Keep the highest-scoring fragments whose total tokens fit the budget.
+    Returns the indices of the kept fragments in their original order."""
+    order = sorted(range(len(fragments)), key=lambda i: scores[i], reverse=True)
+
+    kept = set()
+    used = 0
+    for i in order:
+        tokens = count_tokens(fragments[i], model)
+        if used + tokens <= budget:
+            kept.add(i)
+            used += tokens
+
+    return sorted(kept)
+
+
+def estimate_batch(path, batch=True):
+    """Stream a batch JSONL and estimate tokens and cost before submission.
+    Output cost uses each request's max_tokens, so it is an upper bound."""
+    summary = {
+        "requests": 0,
+        "input_tokens": 0,
+        "max_output_tokens": 0,
+        "max_request_input_tokens": 0,
+        "cost_usd": 0.0,
+        "file_mb": os.path.getsize(path) / 1024**2,
+    }
+    discount = BATCH_DISCOUNT if batch else 1.0
+    counters = {}
+
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            body = json.loads(line)["body"]
+            model = body["model"]
+            counter = counters.setdefault(model, PrefixTokenCounter(model))
+            input_tokens = counter.count_messages(body["messages"])
+            output_tokens = body.get("max_tokens", 0)
+
+            summary["requests"] += 1
+            summary["input_tokens"] += input_tokens
+            summary["max_output_tokens"] += output_tokens
+            summary["max_request_input_tokens"] = max(
+                summary["max_request_input_tokens"], input_tokens
+            )
+
+            prices = MODEL_PRICES.get(model)
+            if prices:
+                summary["cost_usd"] += discount * (
+                    input_tokens * prices["input"] + output_tokens * prices["output"]
+                ) / 1e6
+
+    return summary
+
+
+def check_batch(path, max_input_tokens=None, max_cost_usd=None, batch=True):
+    """Estimate a batch file and raise ValueError if it breaks a limit.
+    Returns the estimate otherwise."""
+    summary = estimate_batch(path, batch)
+
+    problems = []
+    if summary["requests"] > MAX_BATCH_REQUESTS:
+        problems.append(f"{summary['requests']} requests > {MAX_BATCH_REQUESTS}")
+    if summary["file_mb"] > MAX_BATCH_FILE_MB:
+        problems.append(f"{summary['file_mb']:.1f} MB > {MAX_BATCH_FILE_MB} MB")
+    if max_input_tokens and summary["input_tokens"] > max_input_tokens:
+        problems.append(f"{summary['input_tokens']} input tokens > {max_input_tokens}")
+    if max_cost_usd and summary["cost_usd"] > max_cost_usd:
+        problems.append(f"${summary['cost_usd']:.2f} > ${max_cost_usd:.2f}")
+
+    if problems:
+        raise ValueError(f"Batch {path} is too large: " + "; ".join(problems))
+
+    return summary
+
+
+def format_estimate(summary):
+    return (
+        f"{summary['requests']} requests, {summary['input_tokens']:,} input tokens "
+        f"(max {summary['max_request_input_tokens']:,} per request), "
+        f"<= {summary['max_output_tokens']:,} output tokens, "
+        f"~${summary['cost_usd']:.4f}, {summary['file_mb']:.2f} MB"
+    )